@@ -0,0 +1,214 @@
+"""Benchmarks comparing the speed of parts of the data pipeline with the implementations they replaced."""
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import config
+from cli import COMMAND_MODULES
+from process import process_data
+from draft import keras_predict, recommend, search
+from matches import decode_history, page_filter
+from hero_index import load_hero_index
+from inference import export_weights, numpy_predict
+from synthetic import history_pages, random_drafts, write_database
+from train import hero_count, one_hot_matrix, picks_matrix, picks_vector
+
+
+def benchmark_picks_matrix(num_matches=100000):
+    """Compare encoding drafts with picks_matrix against calling picks_vector for each match."""
+    num_heroes = hero_count()
+    hero_matrix = one_hot_matrix(num_heroes)
+    picks_radiant, picks_dire = random_drafts(num_matches)
+    picks_radiant, picks_dire = picks_radiant.tolist(), picks_dire.tolist()
+
+    def loop():
+        data = np.empty((num_matches, num_heroes), dtype=int)
+        for m in range(num_matches):
+            data[m] = picks_vector(picks_radiant[m], picks_dire[m], num_heroes, hero_matrix=hero_matrix)
+        return data
+
+    def vectorized():
+        return picks_matrix(picks_radiant, picks_dire, num_heroes, hero_matrix=hero_matrix)
+
+    assert np.array_equal(loop(), vectorized())
+    loop_time = min(timeit.repeat(loop, number=1, repeat=3))
+    vectorized_time = min(timeit.repeat(vectorized, number=1, repeat=3))
+    print(f'picks_matrix ({num_matches} matches): loop {loop_time:.3f} s, vectorized {vectorized_time:.3f} s, '
+          f'speedup {loop_time / vectorized_time:.1f}x')
+
+
+def benchmark_process_memory(sizes=(100000, 400000)):
+    """Show that the peak memory used by process_data does not grow with the size of the database."""
+    with tempfile.TemporaryDirectory() as directory:
+        for num_matches in sizes:
+            filename = os.path.join(directory, f'matches_{num_matches}.jsonl')
+            write_database(filename, num_matches)
+            tracemalloc.start()
+            process_data(filename, os.path.join(directory, 'training_data'), None, None)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f'process_data ({num_matches} matches): peak memory {peak / 2 ** 20:.1f} MiB')
+
+
+def benchmark_recommend(repeat=20):
+    """Compare recommend against calling model.predict for each hero, using an untrained model."""
+    from models import build_model  # Imports TensorFlow, so only in the benchmarks which need it.
+
+    num_heroes = hero_count()
+    hero_matrix = one_hot_matrix(num_heroes)
+    hero_ids = load_hero_index().ids.tolist()
+    model = build_model(num_heroes)
+    predict = keras_predict(model)
+    radiant = [22, 71, 42, 70]
+    dire = [37, 5, 99, 67, 82]
+
+    def loop():
+        return [model.predict(np.array([picks_vector(radiant + [h], dire, num_heroes, hero_matrix)]))[0, 0]
+                for h in hero_ids]
+
+    def batched():
+        return recommend(radiant, dire, 'radiant', predict, hero_ids, hero_matrix)
+
+    batched()  # Build the model's call graph before timing.
+    loop_time = min(timeit.repeat(loop, number=1, repeat=3))
+    batched_time = min(timeit.repeat(batched, number=1, repeat=repeat))
+    print(f'recommend: per-hero predict loop {loop_time * 1000:.1f} ms, batched {batched_time * 1000:.2f} ms, '
+          f'speedup {loop_time / batched_time:.0f}x')
+    for depth in (2, 3):
+        search_time = min(timeit.repeat(lambda: search(radiant[:2], dire[:3], 'radiant', predict, hero_ids, hero_matrix,
+                                                       depth=depth), number=1, repeat=3))
+        print(f'search: {depth}-ply lookahead {search_time * 1000:.1f} ms')
+
+
+def benchmark_inference(batch_size=128):
+    """Compare NumPy inference from exported weights with calling an untrained Keras model."""
+    from models import build_model  # Imports TensorFlow, so only in the benchmarks which need it.
+
+    num_heroes = hero_count()
+    model = build_model(num_heroes)
+    picks_radiant, picks_dire = random_drafts(batch_size)
+    batch = picks_matrix(picks_radiant, picks_dire, num_heroes)
+    predict = keras_predict(model)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'weights.npz')
+        export_weights(model, filename)
+        numpy_predict_batch = numpy_predict(filename)
+    difference = np.abs(predict(batch) - numpy_predict_batch(batch)).max()
+    keras_time = min(timeit.repeat(lambda: predict(batch), number=10, repeat=3)) / 10
+    numpy_time = min(timeit.repeat(lambda: numpy_predict_batch(batch), number=10, repeat=3)) / 10
+    print(f'inference ({batch_size} drafts): Keras {keras_time * 1000:.2f} ms, NumPy {numpy_time * 1000:.2f} ms, '
+          f'max difference {difference:.2e}')
+
+
+def recorded_responses(directory):
+    """Return the GetMatchHistoryBySequenceNum response bodies recorded in a directory by stub_server."""
+    responses = []
+    for filename in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        with open(filename) as f:
+            record = json.load(f)
+        if record['path'].endswith('/GetMatchHistoryBySequenceNum/v1') and record['status'] == 200:
+            responses.append(record['body'])
+    return responses
+
+
+def decode_strings(body, game_mode, lobby_type, human_players, start_match_id, end_match_id):
+    """Decode a response like the fetch loop did before decode_history, finding teams from player slot strings."""
+    page = []
+    for m in json.loads(body)['result']['matches']:
+        try:
+            lobby_condition = m['lobby_type'] in lobby_type
+        except TypeError:
+            lobby_condition = m['lobby_type'] == lobby_type
+        try:
+            mode_condition = m['game_mode'] in game_mode
+        except TypeError:
+            mode_condition = m['game_mode'] == game_mode
+        if (lobby_condition and mode_condition and start_match_id <= m['match_id'] <= end_match_id and
+                m['human_players'] == human_players):
+            picks_radiant = []
+            picks_dire = []
+            for p in m['players']:
+                try:
+                    if p['leaver_status'] not in {0, 1}:
+                        break
+                except KeyError:
+                    break
+                player_slot = bin(p['player_slot'])[2:].zfill(8)
+                if int(player_slot[0]):
+                    picks_dire.append(p['hero_id'])
+                else:
+                    picks_radiant.append(p['hero_id'])
+            else:
+                page.append({'match_id': m['match_id'], 'match_seq_num': m['match_seq_num'],
+                             'radiant_win': m['radiant_win'], 'game_mode': m['game_mode'],
+                             'lobby_type': m['lobby_type'], 'picks_radiant': sorted(picks_radiant),
+                             'picks_dire': sorted(picks_dire)})
+    return page
+
+
+def benchmark_decode_pages(directory='recordings', num_pages=200, workers=4):
+    """Compare decode_history, in this process and in a process pool, with decoding player slots as strings.
+
+    Responses recorded by stub_server.RecordingSession in directory are used if there are any, and synthetic responses
+    otherwise.
+    """
+    responses = recorded_responses(directory) if os.path.isdir(directory) else []
+    source = f'{len(responses)} recorded pages' if responses else f'{num_pages} synthetic pages'
+    responses = responses or list(history_pages(100 * num_pages))
+    arguments = (1, 22), (0, 7), 10, 0, 2 ** 63 - 1
+    conditions = page_filter(*arguments)
+    assert [decode_strings(r, *arguments) for r in responses] == [decode_history(r, conditions)['page']
+                                                                   for r in responses]
+    num_matches = sum(len(decode_history(r, conditions)['seq_nums']) for r in responses)
+    strings_time = min(timeit.repeat(lambda: [decode_strings(r, *arguments) for r in responses], number=1, repeat=3))
+    decode_time = min(timeit.repeat(lambda: [decode_history(r, conditions) for r in responses], number=1, repeat=3))
+    with ProcessPoolExecutor(workers) as executor:
+        list(executor.map(decode_history, responses[:workers], [conditions] * workers))  # Start the processes.
+        pool_time = min(timeit.repeat(lambda: list(executor.map(decode_history, responses,
+                                                                [conditions] * len(responses))),
+                                      number=1, repeat=3))
+    print(f'decode pages ({source}, {num_matches} matches): player slot strings {num_matches / strings_time:,.0f} '
+          f'matches/s, decode_history {num_matches / decode_time:,.0f} matches/s, {workers} processes '
+          f'{num_matches / pool_time:,.0f} matches/s')
+
+
+def benchmark_startup(budget=config.STARTUP_TIME_BUDGET, repeat=5):
+    """Time starting each cli.py subcommand, i.e. starting Python and importing its modules, in a new process.
+
+    Every subcommand must start within the budget in seconds and without importing TensorFlow or matplotlib, which
+    train only imports once it starts training. Return whether they all do.
+    """
+    heavy_modules = ('tensorflow', 'matplotlib')
+    code = ('import sys; import cli; cli.import_command(sys.argv[1]); '
+            f'print(",".join(m for m in {heavy_modules!r} if m in sys.modules))')
+    within_budget = True
+    for command in COMMAND_MODULES:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            imported = subprocess.run([sys.executable, '-c', code, command], capture_output=True, text=True,
+                                      check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+            times.append(time.perf_counter() - start)
+        ok = min(times) <= budget and not imported
+        within_budget = within_budget and ok
+        print(f'startup ({command}): {min(times) * 1000:.0f} ms, budget {budget * 1000:.0f} ms, '
+              f'imports {imported or "no TensorFlow or matplotlib"}{"" if ok else " - OVER BUDGET"}')
+    return within_budget
+
+
+if __name__ == '__main__':
+    benchmark_picks_matrix()
+    benchmark_process_memory()
+    benchmark_recommend()
+    benchmark_inference()
+    benchmark_decode_pages()
+    benchmark_startup()
@@ -0,0 +1,127 @@
+"""End-to-end benchmarks of each stage of the pipeline on synthetic matches (see synthetic.py).
+
+Each stage is run in a new process, so the peak resident set size reported is that of the stage alone. The stages
+run in order on the same data: the match database is written, pages of raw API matches are decoded, the database is
+processed into training data, hero statistics are counted, the training data is loaded for training and picks are
+recommended. Results can be appended to a file as JSON lines to track regressions and speedups, e.g.
+`python benchmark_pipeline.py --sizes 10000 1000000 --output benchmarks.jsonl`.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+from database import index_filename
+from draft import recommend
+from hero_index import load_hero_index
+from matches import decode_history, page_filter
+from process import process_data
+from stats import baseline_predict, read_stats, update_stats
+from synthetic import GAME_MODE, LOBBY_TYPE, history_pages, random_drafts, write_database
+from train import hero_count, load_data
+
+SIZES = (10000, 1000000, 10000000)
+RECOMMENDATIONS = 1000  # Drafts recommended for by the recommend stage, whatever the number of matches.
+
+
+def paths(directory):
+    return {'database': os.path.join(directory, 'matches.jsonl'), 'training': os.path.join(directory, 'training_data'),
+            'stats': os.path.join(directory, 'hero_stats.npz')}
+
+
+def stage_write(directory, num_matches):
+    database = paths(directory)['database']
+    for filename in (database, index_filename(database)):
+        if os.path.exists(filename):
+            os.remove(filename)
+    write_database(database, num_matches)
+    return num_matches, None
+
+
+def stage_decode(directory, num_matches):
+    """Decode pages of raw matches, timing only the decoding and not the generation of the pages."""
+    conditions = page_filter(GAME_MODE, LOBBY_TYPE, 10, 0, 2 ** 63 - 1)
+    seconds = 0.0
+    for body in history_pages(num_matches):
+        start = time.perf_counter()
+        decode_history(body, conditions)
+        seconds += time.perf_counter() - start
+    return num_matches, seconds
+
+
+def stage_process(directory, num_matches):
+    process_data(paths(directory)['database'], paths(directory)['training'], None, None, incremental=False)
+    return num_matches, None
+
+
+def stage_stats(directory, num_matches):
+    update_stats(paths(directory)['training'], paths(directory)['stats'], incremental=False)
+    return num_matches, None
+
+
+def stage_load(directory, num_matches):
+    load_data(paths(directory)['training'], hero_count())
+    return num_matches, None
+
+
+def stage_recommend(directory, num_matches):
+    hero_index = load_hero_index()
+    predict = baseline_predict(read_stats(paths(directory)['stats']))
+    picks_radiant, picks_dire = random_drafts(RECOMMENDATIONS, seed=1)
+    hero_ids = hero_index.ids.tolist()
+    for radiant, dire in zip(picks_radiant[:, :4].tolist(), picks_dire.tolist()):
+        recommend(radiant, dire, 'radiant', predict, hero_ids, hero_index.one_hot)
+    return RECOMMENDATIONS, None
+
+
+# Stage functions, in the order they are run. Each returns the number of items it handled and the seconds taken, or
+# None to use the time taken by the whole function.
+STAGES = {'write': stage_write, 'decode': stage_decode, 'process': stage_process, 'stats': stage_stats,
+          'load': stage_load, 'recommend': stage_recommend}
+
+
+def run_stage(stage, directory, num_matches):
+    """Run a stage and return the items handled, the seconds taken and the peak resident set size in bytes."""
+    start = time.perf_counter()
+    items, seconds = STAGES[stage](directory, num_matches)
+    if seconds is None:
+        seconds = time.perf_counter() - start
+    return items, seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # ru_maxrss is in KiB.
+
+
+def benchmark_pipeline(directory, num_matches, stages=tuple(STAGES)):
+    """Run the stages on num_matches synthetic matches in a directory and return a result for each stage."""
+    results = []
+    for stage in stages:
+        # A new process started from scratch, rather than forked, for each stage, so its peak memory is its own.
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            items, seconds, peak_rss = executor.submit(run_stage, stage, directory, num_matches).result()
+        result = {'time': time.time(), 'matches': num_matches, 'stage': stage, 'seconds': seconds,
+                  'peak_rss': peak_rss, 'items_per_second': items / seconds if seconds else None}
+        print('{matches:>10} {stage:10} {seconds:10.2f} s {rss:10.1f} MiB {rate:>14,.0f} /s'.format(
+            rss=peak_rss / 2 ** 20, rate=result['items_per_second'] or 0, **result))
+        results.append(result)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark each stage of the pipeline on synthetic matches.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='numbers of matches')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--output', help='file to append results to as JSON lines')
+    parser.add_argument('--directory', help='directory for the data, instead of a temporary directory')
+    args = parser.parse_args()
+    print('{:>10} {:10} {:>12} {:>14} {:>17}'.format('matches', 'stage', 'wall time', 'peak RSS', 'throughput'))
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            size_directory = os.path.join(args.directory or temporary_directory, str(size))
+            os.makedirs(size_directory, exist_ok=True)
+            size_results = benchmark_pipeline(size_directory, size, args.stages)
+        if args.output:
+            with open(args.output, 'a') as f:
+                for stage_result in size_results:
+                    f.write(json.dumps(stage_result) + '\n')
@@ -0,0 +1,56 @@
+"""Checks that incremental processing of the match database gives the same training data as a full run.
+
+Run `python checks.py`. Each check raises AssertionError if it fails.
+"""
+import os
+import tempfile
+
+import numpy as np
+
+from process import process_data, read_training_data
+from synthetic import write_database
+
+
+def assert_same_training_data(directory, expected_directory):
+    data = read_training_data(directory)
+    expected = read_training_data(expected_directory)
+    for name in expected:
+        assert np.array_equal(data[name], expected[name]), name
+
+
+def check_incremental_processing(sizes=(11, 2, 5, 8, 1000)):
+    """Check that processing matches added in batches of any size gives the same training data as one full run.
+
+    Batches which are not multiples of 8 matches leave a partly filled final byte of packed results, which must be kept
+    when the next batch is appended.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'matches.jsonl')
+        incremental = os.path.join(directory, 'incremental')
+        for seed, num_matches in enumerate(sizes):
+            write_database(database, num_matches, seed)
+            process_data(database, incremental, None, None)
+        process_data(database, os.path.join(directory, 'full'), None, None, incremental=False)
+        assert_same_training_data(incremental, os.path.join(directory, 'full'))
+    print(f'process_data: incremental processing of {sum(sizes)} matches in batches of {sizes} matches the full run')
+
+
+def check_replaced_database(num_matches=100, replacement_matches=150):
+    """Check that the training data is rebuilt when the database is replaced by a larger one."""
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'matches.jsonl')
+        incremental = os.path.join(directory, 'incremental')
+        write_database(database, num_matches, 0)
+        process_data(database, incremental, None, None)
+        os.remove(database)
+        write_database(database, replacement_matches, 1)
+        process_data(database, incremental, None, None)
+        process_data(database, os.path.join(directory, 'full'), None, None, incremental=False)
+        assert_same_training_data(incremental, os.path.join(directory, 'full'))
+    print(f'process_data: replacing a database of {num_matches} matches with {replacement_matches} rebuilds the '
+          f'training data')
+
+
+if __name__ == '__main__':
+    check_incremental_processing()
+    check_replaced_database()
@@ -0,0 +1,137 @@
+"""Command line interface to the pipeline, e.g. `python cli.py recommend --radiant 22 71 --dire 37 5 99`.
+
+Each subcommand imports only the modules it needs when it runs, and only training imports TensorFlow and matplotlib,
+so the other subcommands start in a fraction of a second (see benchmark.benchmark_startup).
+"""
+import argparse
+import importlib
+
+import config
+
+# Modules used by each subcommand, imported only when it runs.
+COMMAND_MODULES = {'fetch': ('matches',), 'heroes': ('heroes',), 'partition': ('partitions',),
+                   'process': ('process', 'partitions'), 'train': ('train',),
+                   'recommend': ('draft', 'hero_index', 'inference', 'stats', 'train')}
+
+
+def import_command(command):
+    """Import and return the modules used by a subcommand."""
+    return [importlib.import_module(name) for name in COMMAND_MODULES[command]]
+
+
+def fetch(args):
+    matches, = import_command('fetch')
+    matches.crawl()
+
+
+def heroes(args):
+    heroes_module, = import_command('heroes')
+    heroes_module.fetch_heroes(config.HERO_DATA_FILE, args.language)
+
+
+def partition(args):
+    partitions, = import_command('partition')
+    partitions.update_partitions(config.MATCH_DATA_FILE, config.MATCH_PARTITIONS_DIRECTORY)
+    if args.compact:
+        partitions.compact_partitions(config.MATCH_PARTITIONS_DIRECTORY)
+
+
+def process(args):
+    process_module, partitions = import_command('process')
+    if args.partitions or args.patch is not None:
+        start, end = partitions.patch_window(args.patch) if args.patch is not None else (args.start, args.end)
+        partitions.process_partitions(config.MATCH_PARTITIONS_DIRECTORY, config.TRAINING_DATA_FILE, start, end,
+                                      incremental=not args.rebuild)
+    else:
+        process_module.process_data(config.MATCH_DATA_FILE, config.TRAINING_DATA_FILE, args.start, args.end,
+                                    incremental=not args.rebuild)
+
+
+def train(args):
+    train_module, = import_command('train')
+    model, history, results = train_module.train(config.TRAINING_DATA_FILE, config.MODEL_FILE, config.WEIGHTS_FILE,
+                                                 args.input_mode, args.stream, args.epochs)
+    train_module.plot_history(history, None if args.show_plots else args.plots)
+    print(results)
+
+
+def recommend(args):
+    draft, hero_index, inference, stats, train_module = import_command('recommend')
+    if args.baseline:
+        hero_stats = stats.read_stats(config.HERO_STATS_FILE)
+        if hero_stats is None:
+            print('{} not found.'.format(config.HERO_STATS_FILE))
+            return
+        predict = stats.baseline_predict(hero_stats)
+    else:
+        try:
+            predict = inference.numpy_predict(config.WEIGHTS_FILE)
+        except FileNotFoundError:
+            print('{} not found.'.format(config.WEIGHTS_FILE))
+            return
+    side = args.side or ('radiant' if len(args.radiant) <= len(args.dire) else 'dire')
+    index = hero_index.load_hero_index()
+    hero_ids = index.ids.tolist()
+    if args.depth > 1:
+        picks = draft.search(args.radiant, args.dire, side, predict, hero_ids, index.one_hot, depth=args.depth,
+                             k=args.k)
+    else:
+        picks = draft.recommend(args.radiant, args.dire, side, predict, hero_ids, index.one_hot, k=args.k)
+    print(f'Best picks for {side}:')
+    train_module.print_recommendations(picks)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Fetch matches, process them into training data, train the model '
+                                                 'and recommend picks.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('fetch', help='fetch new matches with the settings in config.py').set_defaults(run=fetch)
+
+    parser_heroes = subparsers.add_parser('heroes', help='fetch the hero data')
+    parser_heroes.add_argument('--language', default=config.LANGUAGE, help='language of the hero names')
+    parser_heroes.set_defaults(run=heroes)
+
+    parser_partition = subparsers.add_parser('partition', help='partition new matches by patch and match ID range')
+    parser_partition.add_argument('--compact', action='store_true', help='merge the partitions of each key')
+    parser_partition.set_defaults(run=partition)
+
+    parser_process = subparsers.add_parser('process', help='convert new matches to training data')
+    parser_process.add_argument('--start', type=int, default=config.training_start_match_id,
+                                help='first match ID of the training data')
+    parser_process.add_argument('--end', type=int, default=config.training_end_match_id,
+                                help='last match ID of the training data')
+    parser_process.add_argument('--rebuild', action='store_true', help='convert all matches, not only new ones')
+    parser_process.add_argument('--partitions', action='store_true',
+                                help='read only the partitions overlapping the match IDs instead of the database')
+    parser_process.add_argument('--patch', type=int, default=config.training_patch,
+                                help='convert only the matches of a patch, read from the partitions')
+    parser_process.set_defaults(run=process)
+
+    parser_train = subparsers.add_parser('train', help='train the model on the training data')
+    parser_train.add_argument('--input-mode', choices=('dense', 'indices'), default=config.input_mode)
+    parser_train.add_argument('--stream', action='store_true', default=config.stream_training_data,
+                              help='stream the training data from disk instead of loading it into memory')
+    parser_train.add_argument('--epochs', type=int, default=12)
+    parser_train.add_argument('--plots', default=config.PLOT_DIRECTORY,
+                              help='directory in which to save graphs of the training history')
+    parser_train.add_argument('--show-plots', action='store_true', default=config.show_plots,
+                              help='show the graphs in windows instead of saving them')
+    parser_train.set_defaults(run=train)
+
+    parser_recommend = subparsers.add_parser('recommend', help='recommend picks for a draft')
+    parser_recommend.add_argument('--radiant', type=int, nargs='*', default=[], help='hero IDs picked by radiant')
+    parser_recommend.add_argument('--dire', type=int, nargs='*', default=[], help='hero IDs picked by dire')
+    parser_recommend.add_argument('--side', choices=('radiant', 'dire'),
+                                  help='side to pick for (by default the side with fewer picks, radiant if equal)')
+    parser_recommend.add_argument('-k', type=int, default=10, help='number of picks to recommend')
+    parser_recommend.add_argument('--depth', type=int, default=1, help='picks to look ahead, including this one')
+    parser_recommend.add_argument('--baseline', action='store_true',
+                                  help='use the hero statistics baseline instead of the trained model')
+    parser_recommend.set_defaults(run=recommend)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    arguments.run(arguments)
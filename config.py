@@ -2,8 +2,22 @@
 # https://steamcommunity.com/dev/apikey
 STEAM_API_KEY = 'XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX'
 
-# Name of file in which to store raw data.
-MATCH_DATA_FILE = 'matches.json'
+# Base URLs of the APIs. These may be pointed at a local stub server (see stub_server.py) to replay recorded responses.
+STEAM_API_URL = 'https://api.steampowered.com'
+OPENDOTA_API_URL = 'https://api.opendota.com/api'
+# Timeouts in seconds for connecting to and reading responses from the APIs, and maximum connections kept open per host.
+HTTP_CONNECT_TIMEOUT = 10
+HTTP_READ_TIMEOUT = 60
+HTTP_POOL_SIZE = 16
+
+# Maximum request rates (requests per second) and burst sizes (number of requests that may be made at once).
+STEAM_REQUEST_RATE = 1
+STEAM_REQUEST_BURST = 1
+OPENDOTA_REQUEST_RATE = 1
+OPENDOTA_REQUEST_BURST = 1
+
+# Name of file in which to store raw data (one JSON object per match, per line).
+MATCH_DATA_FILE = 'matches.jsonl'
 
 # Filtering parameters for fetching match data. Values as stated at:
 # https://wiki.teamfortress.com/wiki/WebAPI/GetMatchDetails#Result_data
@@ -16,16 +30,77 @@ human_players = 10
 # Set "start_match_id = None" to find and use the first match of the current patch.
 # Set to "start_match_id = 'latest'" to use the most recent match stored in the local database.
 start_match_id = None  # Patch 7.25 begins on match 5298181556.
+# Name of file in which to cache the patches of match IDs probed when finding the first match of the current patch.
+PATCH_CACHE_FILE = 'patches.json'
 # Set "end_match_id = 'latest'" to use the most recent match played.
 end_match_id = 'latest'
+# Number of threads fetching matches. With more than one, the sequence number range is split into shards which are
+# fetched concurrently and checkpointed, so an interrupted crawl resumes where it stopped.
+crawler_workers = 1
+# Number of processes shared by the threads of a concurrent crawl to decode responses. With 0, the threads decode their
+# own responses, holding the GIL while doing so.
+decode_workers = 0
+# Name of file to which crawl metrics (request latencies, matches kept and rejected, progress) are appended as JSON
+# lines every METRICS_INTERVAL seconds. Set "METRICS_FILE = None" to disable.
+METRICS_FILE = 'crawl_metrics.jsonl'
+METRICS_INTERVAL = 60
+# Set "serve_metrics = True" to serve the metrics in the Prometheus text format at
+# http://127.0.0.1:METRICS_PORT/metrics while crawling.
+serve_metrics = False
+METRICS_PORT = 8572
 
-# Name of file in which to store training data.
-TRAINING_DATA_FILE = 'training_data.json'
+# Name of directory in which to store training data.
+TRAINING_DATA_FILE = 'training_data'
 # Match IDs from which to create training data.
 # Set "training_start_match_id = None" for no restriction on start.
 training_start_match_id = None
 # Set "training_end_match_id = None" for no restriction on end.
 training_end_match_id = None
+# Name of directory in which partitions.py stores copies of the matches partitioned by patch and match ID range, and
+# the number of match IDs in each range.
+MATCH_PARTITIONS_DIRECTORY = 'match_partitions'
+PARTITION_MATCH_IDS = 50000000
+# Set "training_patch = <patch>" for partitions.py to create training data from the matches of a patch found by the
+# crawler (see PATCH_CACHE_FILE) instead of those from training_start_match_id to training_end_match_id.
+training_patch = None
+
+# Name of file in which to store hero win rate, synergy and counter statistics counted from the training data.
+HERO_STATS_FILE = 'hero_stats.npz'
+
+# Set "stream_training_data = True" to stream batches of training data from disk while training, instead of loading it
+# all into memory.
+stream_training_data = False
+# Model input: 'dense' for picks vectors, or 'indices' for the picks vector columns of the ten picked heroes, which
+# takes 10 bytes per match instead of a byte per hero (see models.build_embedding_model).
+input_mode = 'dense'
+
+# Names of files in which to save the trained model, and its weights for inference without TensorFlow.
+MODEL_FILE = 'model.h5'
+WEIGHTS_FILE = 'model_weights.npz'
+# Name of directory in which to save graphs of training and validation loss and accuracy. Set "show_plots = True" to
+# show them in windows instead, which needs a display.
+PLOT_DIRECTORY = 'plots'
+show_plots = False
+
+# Hyperparameters tried by sweep.py. Every combination of the values listed is trained on each of sweep_folds folds
+# of the training part of the training data, and unlisted hyperparameters keep the values used by train.py.
+sweep_grid = {'units': [(128, 64), (256, 128)], 'dropout': [0.2, 0.4], 'learning_rate': [0.01, 0.001]}
+sweep_folds = 5
+# Number of models trained at once, and the number of threads each may use (None to share the cores between them).
+sweep_workers = 4
+sweep_threads = None
+# Name of file to which sweep.py appends the result of each model it trains, as JSON lines.
+SWEEP_RESULTS_FILE = 'sweep_results.jsonl'
+
+# Seconds within which cli.py subcommands other than train must start, i.e. import everything they need (see
+# benchmark.benchmark_startup).
+STARTUP_TIME_BUDGET = 1.0
+
+# Port of the draft-serving daemon, and the largest batch of drafts and longest time in seconds it collects drafts from
+# concurrent requests before scoring them together.
+SERVER_PORT = 8571
+SERVER_MAX_BATCH = 4096
+SERVER_MAX_WAIT = 0.002
 
 # Language for hero names.
 LANGUAGE = 'english'
@@ -0,0 +1,223 @@
+"""Append-only store for fetched match data.
+
+Matches are stored one JSON object per line (JSON Lines), so new matches can be appended without rewriting the
+existing data. A line left incomplete by an interrupted write is ignored when reading and removed before the next
+append.
+
+A sidecar index file holds the sorted match IDs, the match count and the sequence number and match ID bounds of the
+database, so these can be queried without parsing the whole database. The index records how many bytes of the
+database it covers and the match ID on the last line it covers, and is brought up to date from the end of the database
+whenever it is loaded.
+"""
+from array import array
+from bisect import bisect_left
+import json
+import os
+import struct
+
+import config
+
+# Name of file used by earlier versions, which stored all matches in a single JSON object.
+LEGACY_MATCH_DATA_FILE = 'matches.json'
+
+# Index header: bytes of database indexed, match ID on the last line indexed, match count, min/max sequence number and
+# min/max match ID. Indexes written with an older header do not match their size, so are rebuilt.
+INDEX_HEADER = struct.Struct('<7q')
+INDEX_NONE = -1  # Header value used for bounds of an empty database.
+
+
+def read_match_offsets(filename, offset=0):
+    """Yield (end offset, match) pairs for matches stored after the given byte offset."""
+    with open(filename, 'rb') as data:
+        data.seek(offset)
+        for line in data:
+            if not line.endswith(b'\n'):  # Incomplete final line from an interrupted write.
+                break
+            offset += len(line)
+            yield offset, json.loads(line)
+
+
+def read_matches(filename, offset=0):
+    """Yield matches stored in the database in the order they were written."""
+    for _, match in read_match_offsets(filename, offset):
+        yield match
+
+
+def match_ending_at(filename, offset):
+    """Return the match on the line ending at the given byte offset, or None if no complete line ends there."""
+    if offset <= 0:
+        return None
+    with open(filename, 'rb') as data:
+        if offset > data.seek(0, os.SEEK_END):
+            return None
+        position = offset - 1
+        data.seek(position)
+        if data.read(1) != b'\n':
+            return None
+        line = b''
+        while position > 0:
+            block_start = max(0, position - 4096)
+            data.seek(block_start)
+            line = data.read(position - block_start) + line
+            newline = line.rfind(b'\n')
+            if newline != -1:
+                line = line[newline + 1:]
+                break
+            position = block_start
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+def _truncate_partial_line(data):
+    """Remove an incomplete final line from a file opened in binary read/write mode."""
+    end = data.seek(0, os.SEEK_END)
+    position = end
+    while position > 0:
+        block_start = max(0, position - 4096)
+        data.seek(block_start)
+        block = data.read(position - block_start)
+        if position == end and block.endswith(b'\n'):
+            return
+        newline = block.rfind(b'\n')
+        if newline != -1:
+            data.truncate(block_start + newline + 1)
+            return
+        position = block_start
+    data.truncate(0)
+
+
+def append_matches(filename, matches, index=None):
+    """Append matches to the database and make sure they are written to disk.
+
+    If an index is given, it is updated with the new matches and written to file.
+    """
+    lines = ''.join(json.dumps(m) + '\n' for m in matches).encode()
+    mode = 'r+b' if os.path.exists(filename) else 'wb'
+    with open(filename, mode) as data:
+        _truncate_partial_line(data)
+        data.seek(0, os.SEEK_END)
+        data.write(lines)
+        data.flush()
+        os.fsync(data.fileno())
+        end = data.tell()
+    if index is not None:
+        index_matches(index, matches, end)
+        write_index(filename, index)
+
+
+def index_filename(filename):
+    return filename + '.idx'
+
+
+def empty_index():
+    return {'offset': 0, 'last_match_id': None, 'count': 0, 'min_seq_num': None, 'max_seq_num': None,
+            'min_match_id': None, 'max_match_id': None, 'match_ids': array('q')}
+
+
+def index_matches(index, matches, offset):
+    """Add matches to an index, which then covers the database up to the given byte offset."""
+    new_ids = sorted(m['match_id'] for m in matches)
+    if new_ids:
+        match_ids = index['match_ids']
+        # Only the part of the sorted IDs that follows the smallest new ID needs to be merged.
+        position = bisect_left(match_ids, new_ids[0])
+        match_ids[position:] = array('q', sorted(match_ids[position:].tolist() + new_ids))
+        seq_nums = [m['match_seq_num'] for m in matches]
+        for key, value, bound in (('min_seq_num', min(seq_nums), min), ('max_seq_num', max(seq_nums), max),
+                                  ('min_match_id', new_ids[0], min), ('max_match_id', new_ids[-1], max)):
+            index[key] = value if index[key] is None else bound(index[key], value)
+        index['count'] += len(matches)
+        index['last_match_id'] = matches[-1]['match_id']
+    index['offset'] = offset
+
+
+def index_contains(index, match_id):
+    """Return True if the match ID is stored in the indexed database."""
+    match_ids = index['match_ids']
+    position = bisect_left(match_ids, match_id)
+    return position < len(match_ids) and match_ids[position] == match_id
+
+
+def write_index(filename, index):
+    bounds = [INDEX_NONE if index[k] is None else index[k]
+              for k in ('last_match_id', 'min_seq_num', 'max_seq_num', 'min_match_id', 'max_match_id')]
+    temporary = index_filename(filename) + '.tmp'
+    with open(temporary, 'wb') as index_file:
+        index_file.write(INDEX_HEADER.pack(index['offset'], bounds[0], index['count'], *bounds[1:]))
+        index['match_ids'].tofile(index_file)
+    os.replace(temporary, index_filename(filename))
+
+
+def read_index(filename):
+    """Return the index stored for the database, or an empty index if there is none."""
+    index = empty_index()
+    try:
+        with open(index_filename(filename), 'rb') as index_file:
+            header = index_file.read(INDEX_HEADER.size)
+            if len(header) < INDEX_HEADER.size:
+                return index
+            offset, last_match_id, count, *bounds = INDEX_HEADER.unpack(header)
+            match_ids = array('q')
+            match_ids.frombytes(index_file.read(8 * count))
+            if len(match_ids) != count or index_file.read(1):
+                return index
+    except FileNotFoundError:
+        return index
+    index.update(offset=offset, count=count, match_ids=match_ids)
+    for key, value in zip(('last_match_id', 'min_seq_num', 'max_seq_num', 'min_match_id', 'max_match_id'),
+                          (last_match_id, *bounds)):
+        index[key] = None if value == INDEX_NONE else value
+    return index
+
+
+def load_index(filename):
+    """Return an up-to-date index for the database.
+
+    Matches appended since the index was written are indexed and the index file is updated. The index is rebuilt if
+    it is missing or does not match the database. Raises FileNotFoundError if the database does not exist.
+    """
+    index = read_index(filename)
+    if index['offset'] > 0:
+        last_match = match_ending_at(filename, index['offset'])
+        if last_match is None or last_match['match_id'] != index['last_match_id']:
+            index = empty_index()  # Database has been replaced since the index was written.
+    size = os.path.getsize(filename)
+    if index['offset'] < size:
+        offset = index['offset']
+        new_matches = []
+        for offset, match in read_match_offsets(filename, offset):
+            new_matches.append(match)
+        if offset > index['offset']:
+            index_matches(index, new_matches, offset)
+            write_index(filename, index)
+    return index
+
+
+def database_size(filename):
+    """Return the number of matches stored in the database."""
+    return load_index(filename)['count']
+
+
+def migrate_database(legacy_filename, filename):
+    """Convert a database stored as {"data_size": ..., "matches": [...]} into the append-only format."""
+    if os.path.exists(filename):
+        print(f'{filename} already exists. Remove it before migrating.')
+        return
+    try:
+        with open(legacy_filename) as data:
+            matches = json.load(data)['matches']
+    except FileNotFoundError:
+        print(f'{legacy_filename} not found.')
+        return
+    temporary = filename + '.tmp'
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    append_matches(temporary, matches)
+    os.replace(temporary, filename)
+    print(f'Migrated {len(matches)} matches from {legacy_filename} to {filename}.')
+
+
+if __name__ == '__main__':
+    migrate_database(LEGACY_MATCH_DATA_FILE, config.MATCH_DATA_FILE)
@@ -0,0 +1,122 @@
+"""Draft recommendations from a trained model."""
+from itertools import chain
+
+import numpy as np
+
+from hero_index import load_hero_index
+
+SIDES = {'radiant': 1, 'dire': -1}
+TEAMS = {'radiant': 0, 'dire': 1}  # Position of each side's team in a (radiant, dire) draft.
+
+
+def keras_predict(model):
+    """Return a function giving the radiant win probabilities of a batch of picks vectors from a Keras model.
+
+    The model is called directly rather than through model.predict, which has a large overhead per call.
+    """
+    def predict(batch):
+        return model(batch.astype(np.float32), training=False).numpy()[:, 0]
+    return predict
+
+
+def candidate_batch(radiant, dire, side, hero_ids, hero_matrix):
+    """Return the heroes which side may pick and the picks vectors of the drafts resulting from each pick."""
+    if side not in SIDES:
+        raise ValueError(f"side must be 'radiant' or 'dire', not {side!r}.")
+    current_picks = set(radiant) | set(dire)
+    candidates = np.array([h for h in hero_ids if h not in current_picks], dtype=np.intp)
+    base = hero_matrix[list(radiant)].sum(axis=0) - hero_matrix[list(dire)].sum(axis=0)
+    batch = base + SIDES[side] * hero_matrix[candidates]
+    return candidates, batch
+
+
+def recommend(radiant, dire, side, predict, hero_ids, hero_matrix, k=10):
+    """Return the k best heroes for side to pick as (hero ID, win probability for side) pairs, best first.
+
+    Every hero not already picked is scored in a single call of predict, which maps a batch of picks vectors to
+    radiant win probabilities. hero_matrix is the matrix given by train.one_hot_matrix.
+    """
+    candidates, batch = candidate_batch(radiant, dire, side, hero_ids, hero_matrix)
+    radiant_win = np.asarray(predict(batch))
+    side_win = radiant_win if side == 'radiant' else 1 - radiant_win
+    k = min(k, candidates.size)
+    best = np.argpartition(-side_win, k - 1)[:k] if k else np.zeros(0, dtype=np.intp)
+    best = best[np.argsort(-side_win[best])]
+    return [(int(candidates[i]), float(side_win[i])) for i in best]
+
+
+def evaluate(states, predict, hero_matrix, cache):
+    """Return the radiant win probabilities of drafts given as (radiant, dire) pairs of frozensets.
+
+    Drafts not in the cache are scored in a single call of predict and added to the cache. Their picks vectors are
+    built in one assignment from the picks vector columns of all their heroes, as train.encode_columns does.
+    """
+    missing = [s for s in dict.fromkeys(states) if s not in cache]
+    if missing:
+        num_heroes = hero_matrix.shape[1]
+        teams = [team for state in missing for team in state]  # Radiant and dire team of each draft in turn.
+        team_sizes = np.fromiter(map(len, teams), dtype=np.intp, count=len(teams))
+        heroes = np.fromiter(chain.from_iterable(teams), dtype=np.intp, count=team_sizes.sum())
+        team_of_pick = np.repeat(np.arange(len(teams)), team_sizes)
+        # Columns of num_heroes or more do not belong to a hero and are dropped.
+        batch = np.zeros((len(missing), num_heroes + 1), dtype=hero_matrix.dtype)
+        batch[team_of_pick // 2, np.minimum(load_hero_index().columns[heroes], num_heroes)] = 1 - 2 * (team_of_pick % 2)
+        for state, radiant_win in zip(missing, np.asarray(predict(batch[:, :num_heroes]))):
+            cache[state] = float(radiant_win)
+    return [cache[s] for s in states]
+
+
+def search(radiant, dire, side, predict, hero_ids, hero_matrix, depth=2, beam=8, k=10, cache=None, team_size=5):
+    """Return the k best heroes for side to pick as (hero ID, win probability for side) pairs, best first.
+
+    Looks ahead depth picks, alternating between the sides while both have picks left, and assumes each side makes
+    the pick best for it (minimax). Only the beam best picks of each draft by immediate evaluation are searched
+    further. Drafts are cached by their unordered teams, since the order of picks does not affect the evaluation, and
+    each level of the search is evaluated in a single batch. A cache may be passed to reuse evaluations between
+    searches.
+    """
+    if side not in SIDES:
+        raise ValueError(f"side must be 'radiant' or 'dire', not {side!r}.")
+    if len(radiant if side == 'radiant' else dire) >= team_size:
+        raise ValueError(f'{side} has no picks left.')
+    cache = {} if cache is None else cache
+    other_side = {'radiant': 'dire', 'dire': 'radiant'}
+    root = (frozenset(radiant), frozenset(dire))
+    children = {}  # Draft -> (side to pick, list of (hero ID, resulting draft) searched further).
+    level = [root]
+    for ply in range(depth):
+        expansions = []
+        for state in level:
+            mover = side if ply % 2 == 0 else other_side[side]
+            if len(state[TEAMS[mover]]) >= team_size:
+                mover = other_side[mover]
+                if len(state[TEAMS[mover]]) >= team_size:
+                    continue  # Draft is complete.
+            picked = state[0] | state[1]
+            picks = [(h, (state[0] | {h}, state[1]) if mover == 'radiant' else (state[0], state[1] | {h}))
+                     for h in hero_ids if h not in picked]
+            expansions.append((state, mover, picks))
+        values = iter(evaluate([child for _, _, picks in expansions for _, child in picks], predict, hero_matrix,
+                               cache))
+        level = []
+        for state, mover, picks in expansions:
+            scored = [(next(values), pick) for pick in picks]
+            scored.sort(key=lambda scored_pick: scored_pick[0], reverse=mover == 'radiant')
+            width = max(beam, k) if state == root else beam
+            children[state] = (mover, [pick for _, pick in scored[:width]])
+            level.extend(child for _, child in children[state][1])
+        level = list(dict.fromkeys(level))
+
+    def value(state):
+        """Return the radiant win probability of a draft if both sides pick as well as possible from it."""
+        if state not in children:
+            return cache[state]
+        mover, picks = children[state]
+        child_values = (value(child) for _, child in picks)
+        return max(child_values) if mover == 'radiant' else min(child_values)
+
+    _, picks = children[root]
+    results = [(h, value(child)) for h, child in picks]
+    results = [(h, radiant_win if side == 'radiant' else 1 - radiant_win) for h, radiant_win in results]
+    results.sort(key=lambda result: result[1], reverse=True)
+    return results[:k]
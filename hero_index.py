@@ -0,0 +1,38 @@
+"""Cached lookup tables for the heroes in the hero data file.
+
+Hero IDs are not contiguous, so each hero is also given an index, or column, in picks vectors. The hero data file is
+read once per process and the tables are shared by all modules.
+"""
+from collections import namedtuple
+from functools import lru_cache
+import json
+
+import numpy as np
+
+import config
+
+# heroes: hero dicts from the hero data file, in order of index.
+# ids: hero ID of each index.
+# names: localized name of each index.
+# columns: index of each hero ID from 0 to the largest ID, with IDs not belonging to a hero mapped to len(ids).
+# one_hot: one-hot row of each hero ID, shape (largest ID + 1, len(ids)), with rows of zeros for other IDs.
+HeroIndex = namedtuple('HeroIndex', ['heroes', 'ids', 'names', 'columns', 'one_hot'])
+
+
+@lru_cache(maxsize=None)
+def load_hero_index(filename=None):
+    """Return the HeroIndex for the hero data file, which defaults to config.HERO_DATA_FILE.
+
+    Raises FileNotFoundError if there is no hero data file.
+    """
+    with open(config.HERO_DATA_FILE if filename is None else filename) as hero_file:
+        heroes = tuple(sorted(json.load(hero_file)['heroes'], key=lambda h: h['id']))
+    ids = np.array([h['id'] for h in heroes], dtype=np.intp)
+    num_heroes = ids.size
+    columns = np.full(ids.max(initial=0) + 1, num_heroes, dtype=np.intp)
+    columns[ids] = np.arange(num_heroes)
+    one_hot = np.zeros((columns.size, num_heroes), dtype=int)
+    one_hot[ids, np.arange(num_heroes)] = 1
+    for array in (ids, columns, one_hot):
+        array.flags.writeable = False  # Shared by every caller.
+    return HeroIndex(heroes, ids, tuple(h['localized_name'] for h in heroes), columns, one_hot)
@@ -3,13 +3,16 @@ from time import sleep
 import requests
 
 import config
+from hero_index import load_hero_index
 from process import write_json_data
+from ratelimit import steam_limiter
+import sessions
 
 
 def get_heroes(language):
-    base = 'http://api.steampowered.com/IEconDOTA2_570/GetHeroes/v1'
+    base = config.STEAM_API_URL + '/IEconDOTA2_570/GetHeroes/v1'
     payload = {'key': config.STEAM_API_KEY, 'language': language}
-    response = requests.get(base, params=payload)
+    response = steam_limiter.request(sessions.get, base, params=payload)
     return response
 
 
@@ -24,6 +27,7 @@ def fetch_heroes(filename, language):
             count = result['count']
             hero_data = {'heroes': heroes, 'count': count}
             write_json_data(filename, hero_data)
+            load_hero_index.cache_clear()
             print('Hero data saved to {} successfully.'.format(filename))
             break
         else:
@@ -0,0 +1,51 @@
+"""Model inference with NumPy, without importing TensorFlow.
+
+The weights of the Dense layers of a trained model are exported to a .npz file, which is all that is needed to
+compute the model's predictions. Dropout layers do nothing at inference time and are not exported.
+"""
+import numpy as np
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'sigmoid': lambda x: 1 / (1 + np.exp(-x)),
+}
+
+
+def export_weights(model, filename):
+    """Save the kernels, biases and activations of a Keras model's Dense layers."""
+    arrays = {}
+    activations = []
+    for layer in model.layers:
+        weights = layer.get_weights()
+        if not weights:  # Dropout layers have no weights.
+            continue
+        kernel, bias = weights
+        arrays[f'kernel_{len(activations)}'] = kernel.astype(np.float32)
+        arrays[f'bias_{len(activations)}'] = bias.astype(np.float32)
+        activations.append(layer.activation.__name__)
+    np.savez(filename, activations=np.array(activations), **arrays)
+
+
+def load_weights(filename):
+    """Return the layers saved by export_weights as a list of (kernel, bias, activation name) tuples."""
+    with np.load(filename) as weights:
+        return [(weights[f'kernel_{i}'], weights[f'bias_{i}'], str(activation))
+                for i, activation in enumerate(weights['activations'])]
+
+
+def forward(layers, batch):
+    """Return the outputs of the model for a batch of inputs."""
+    x = np.asarray(batch, dtype=np.float32)
+    for kernel, bias, activation in layers:
+        x = ACTIVATIONS[activation](x @ kernel + bias)
+    return x
+
+
+def numpy_predict(filename):
+    """Return a function giving the radiant win probabilities of a batch of picks vectors from exported weights."""
+    layers = load_weights(filename)
+
+    def predict(batch):
+        return forward(layers, batch)[:, 0]
+    return predict
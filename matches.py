@@ -1,42 +1,21 @@
 """Retrieves Dota match data and outputs it to file as JSON."""
 import json
+import os
+import threading
 import time
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from operator import itemgetter
 
 import requests
 
 import config
+from database import append_matches, empty_index, index_contains, load_index, read_matches
+from metrics import crawler_metrics, export_metrics, format_duration
 from process import write_json_data
-
-REQUEST_PERIOD_OPENDOTA = 1  # seconds
-REQUEST_PERIOD_STEAM = 1  # seconds
-
-last_call_opendota = None
-last_call_steam = None
-
-
-def rate_limited(request_period, last_call_time, request_function, *args, **kwargs):
-    """Delay function call if too little time has passed."""
-    if last_call_time is None:
-        last_call_time = -request_period
-    while True:
-        current_time = time.perf_counter()
-        time_since_last_call = current_time - last_call_time
-        if time_since_last_call < request_period:
-            time.sleep(request_period - time_since_last_call)
-        try:
-            response = request_function(*args, **kwargs)
-        except requests.exceptions.ConnectionError:
-            print('ConnectionError. Waiting before retrying.')
-            time.sleep(30)
-            continue
-        last_call_time = time.perf_counter()
-        status = response.status_code
-        if status == 429 or status == 503:  # 429 Too Many Requests, 503 Service Unavailable.
-            print(f'HTTP status code: {status}. Waiting before retrying.')
-            time.sleep(30)
-            continue
-        break
-    return response, last_call_time
+from ratelimit import opendota_limiter, steam_limiter
+import sessions
 
 
 def get_match_details(match_id):
@@ -44,10 +23,9 @@ def get_match_details(match_id):
 
     https://wiki.teamfortress.com/wiki/WebAPI/GetMatchDetails
     """
-    base = 'https://api.steampowered.com/IDOTA2Match_570/GetMatchDetails/v1'
+    base = config.STEAM_API_URL + '/IDOTA2Match_570/GetMatchDetails/v1'
     payload = {'key': config.STEAM_API_KEY, 'match_id': match_id}
-    global last_call_steam
-    response, last_call_steam = rate_limited(REQUEST_PERIOD_STEAM, last_call_steam, requests.get, base, params=payload)
+    response = steam_limiter.request(sessions.get, base, params=payload)
     return response
 
 
@@ -56,11 +34,10 @@ def get_match_history(**kwargs):
 
     https://wiki.teamfortress.com/wiki/WebAPI/GetMatchHistory
     """
-    base = 'https://api.steampowered.com/IDOTA2Match_570/GetMatchHistory/v1'
+    base = config.STEAM_API_URL + '/IDOTA2Match_570/GetMatchHistory/v1'
     if 'key' not in kwargs:
         kwargs['key'] = config.STEAM_API_KEY
-    global last_call_steam
-    response, last_call_steam = rate_limited(REQUEST_PERIOD_STEAM, last_call_steam, requests.get, base, params=kwargs)
+    response = steam_limiter.request(sessions.get, base, params=kwargs)
     return response
 
 
@@ -69,11 +46,10 @@ def get_match_history_by_seq_num(start_at_match_seq_num, matches_requested=100):
 
     https://wiki.teamfortress.com/wiki/WebAPI/GetMatchHistoryBySequenceNum
     """
-    base = 'https://api.steampowered.com/IDOTA2Match_570/GetMatchHistoryBySequenceNum/v1'
+    base = config.STEAM_API_URL + '/IDOTA2Match_570/GetMatchHistoryBySequenceNum/v1'
     payload = {'key': config.STEAM_API_KEY, 'start_at_match_seq_num': start_at_match_seq_num,
                'matches_requested': matches_requested}
-    global last_call_steam
-    response, last_call_steam = rate_limited(REQUEST_PERIOD_STEAM, last_call_steam, requests.get, base, params=payload)
+    response = steam_limiter.request(sessions.get, base, params=payload)
     return response
 
 
@@ -82,10 +58,9 @@ def get_opendota_match(match_id):
 
     https://docs.opendota.com/#tag/matches%2Fpaths%2F~1matches~1%7Bmatch_id%7D%2Fget
     """
-    base = 'https://api.opendota.com/api/matches/'
+    base = config.OPENDOTA_API_URL + '/matches/'
     request_url = base + str(match_id)
-    global last_call_opendota
-    response, last_call_opendota = rate_limited(REQUEST_PERIOD_OPENDOTA, last_call_opendota, requests.get, request_url)
+    response = opendota_limiter.request(sessions.get, request_url)
     return response
 
 
@@ -111,87 +86,132 @@ def latest_match_id():
 
 def greatest_database_seq_num(filename):
     """Return the greatest match sequence number stored in the local database."""
-    with open(filename) as data:
-        database = json.load(data)
-    matches = database['matches']
-    match_seq_nums = [m['match_seq_num'] for m in matches]
-    return max(match_seq_nums)
+    return load_index(filename)['max_seq_num']
 
 
 def smallest_database_match_id(filename):
     """Return the smallest match ID stored in the local database."""
-    with open(filename) as data:
-        database = json.load(data)
-    matches = database['matches']
-    match_ids = [m['match_id'] for m in matches]
-    return min(match_ids)
+    return load_index(filename)['min_match_id']
+
 
+def read_patch_cache(filename):
+    """Return the patches of previously probed match IDs and the first match IDs of previously found patches.
 
-def current_patch_match_id():
+    The patch of a match ID which OpenDota does not have is stored as None.
+    """
+    try:
+        with open(filename) as cache_file:
+            cache = json.load(cache_file)
+    except FileNotFoundError:
+        return {'probes': {}, 'boundaries': {}}
+    return {'probes': {int(m): p for m, p in cache['probes'].items()},
+            'boundaries': {int(p): m for p, m in cache['boundaries'].items()}}
+
+
+# Most match IDs probed looking for the first match above a match ID OpenDota does not have.
+MAX_NEAR_PROBES = 128
+
+
+def current_patch_match_id(cache_file=config.PATCH_CACHE_FILE):
     """Return the match ID for the first match of the current patch.
 
-    Uses a binary search algorithm.
+    Uses a binary search algorithm, starting from the bounds given by earlier searches. The patch of every match ID
+    probed is cached, so repeated searches within a patch only need the patch of the latest match.
     """
-    match_id_lower = 0
-    match_id_upper = latest_match_id()
-    current_patch = get_opendota_match(match_id_upper).json()['patch']
-    api_calls = 1
-    while match_id_upper - match_id_lower > 1:
-        match_id_mid = (match_id_lower + match_id_upper) // 2
-        opendota_match = get_opendota_match(match_id_mid)
-        status_code = opendota_match.status_code
-        api_calls += 1
-        if status_code == 404:  # Match ID not found.
-            # Expand match ID ball around midpoint until endpoints are valid match IDs.
-            match_id_ball_lower = match_id_mid - 1
-            match_id_ball_upper = match_id_mid + 1
-            while True:
-                opendota_match_lower = get_opendota_match(match_id_ball_lower)
-                api_calls += 1
-                if opendota_match_lower.status_code == 200:
-                    break
-                match_id_ball_lower -= 1
-            while True:
-                opendota_match_upper = get_opendota_match(match_id_ball_upper)
-                api_calls += 1
-                if opendota_match_upper.status_code == 200:
-                    break
-                match_id_ball_upper += 1
-            # Update bounds on match IDs accordingly.
-            patch_lower = opendota_match_lower.json()['patch']
-            patch_upper = opendota_match_upper.json()['patch']
-            if patch_upper < current_patch:
-                match_id_lower = match_id_ball_upper
-            elif patch_lower == current_patch:
-                match_id_upper = match_id_ball_lower
+    cache = read_patch_cache(cache_file)
+    probes = cache['probes']
+    boundaries = cache['boundaries']
+    api_calls = 0
+
+    def patch_of(match_id):
+        nonlocal api_calls
+        if match_id not in probes:
+            opendota_match = get_opendota_match(match_id)
+            api_calls += 1
+            status_code = opendota_match.status_code
+            if status_code == 200:
+                probes[match_id] = opendota_match.json()['patch']
+            elif status_code == 404:  # Match ID not found.
+                probes[match_id] = None
             else:
-                match_id_upper = match_id_ball_upper
-                break
-        elif status_code == 200:
-            patch = opendota_match.json()['patch']  # Patch of midpoint.
+                raise LookupError(f'HTTP status code: {status_code}.')
+        return probes[match_id]
+
+    def match_above(match_id, ceiling):
+        """Return the first match ID between match_id and ceiling (exclusive) which OpenDota has, or None if none found.
+
+        Probes upwards from match_id in exponentially growing steps. When a step finds a match or passes the ceiling,
+        probes again from the last match ID probed, up to that match or the ceiling. Gives up after MAX_NEAR_PROBES
+        probes, returning the lowest match found.
+        """
+        match_found = None
+        probes_made = 0
+        step = 1
+        while match_id + 1 < ceiling and probes_made < MAX_NEAR_PROBES:
+            if match_id + step < ceiling:
+                probes_made += 1
+                if patch_of(match_id + step) is None:
+                    step *= 2
+                    continue
+                match_found = ceiling = match_id + step
+            # Probe again from the last match ID probed, which OpenDota does not have.
+            match_id += step // 2
+            step = 1
+        return match_found
+
+    try:
+        match_id_upper = latest_match_id()
+        current_patch = patch_of(match_id_upper)
+        if current_patch is None:
+            raise LookupError(f'Latest match {match_id_upper} not found.')
+        if current_patch in boundaries:
+            match_id_upper = boundaries[current_patch]
+            print(f'Fetched patch match ID ({match_id_upper}) from {cache_file}. {api_calls} OpenDota API calls made.')
+            return match_id_upper
+        # Seed bounds from matches probed in earlier searches.
+        known = [(m, p) for m, p in probes.items() if p is not None]
+        match_id_lower = max((m for m, p in known if p < current_patch), default=0)
+        match_id_upper = min((m for m, p in known if p == current_patch and m > match_id_lower),
+                             default=match_id_upper)
+        # The first match of the current patch is match_id_upper, or between match_id_lower and match_id_ceiling.
+        match_id_ceiling = match_id_upper
+        while match_id_ceiling - match_id_lower > 1:
+            match_id_mid = (match_id_lower + match_id_ceiling) // 2
+            patch = patch_of(match_id_mid)
+            if patch is None:
+                match_id_found = match_above(match_id_mid, match_id_ceiling)
+                if match_id_found is not None and probes[match_id_found] < current_patch:
+                    match_id_lower = match_id_found
+                    continue
+                # Take OpenDota to have no matches between the midpoint and the match found, or the ceiling.
+                if match_id_found is not None:
+                    match_id_upper = match_id_found
+                match_id_ceiling = match_id_mid
             # Update bounds on match IDs accordingly.
-            if patch < current_patch:
+            elif patch < current_patch:
                 match_id_lower = match_id_mid
             else:
-                match_id_upper = match_id_mid
-        else:
-            print('Failed to find first match ID of current patch.')
-            return
+                match_id_upper = match_id_ceiling = match_id_mid
+        boundaries[current_patch] = match_id_upper
+    except LookupError as error:
+        print(f'Failed to find first match ID of current patch. {error}')
+        return
+    finally:
+        write_json_data(cache_file, cache)
     print(f'Fetched patch match ID ({match_id_upper}). {api_calls} OpenDota API calls made.')
     return match_id_upper
 
 
-def fetch_matches(filename, game_mode, lobby_type, human_players=10, start_match_id=None, end_match_id=None):
-    """Fetch matches and write data to file if specified conditions are met."""
+def search_range(index, start_match_id, end_match_id):
+    """Return the sequence numbers and match IDs bounding the matches to fetch, or None if they cannot be found."""
     max_match_length = 18000  # seconds
     # Setup start sequence number.
     if start_match_id == 'latest':
-        try:
-            search_start_seq_num = greatest_database_seq_num(filename)
-        except FileNotFoundError:
-            print(f"{filename} not found. Cannot use start_match_id = 'latest' in config.")
+        if not index['count']:
+            print("Database not found. Cannot use start_match_id = 'latest' in config.")
             return
-        start_match_id = smallest_database_match_id(filename)
+        search_start_seq_num = index['max_seq_num']
+        start_match_id = index['min_match_id']
     else:
         if start_match_id is None:
             start_match_id = current_patch_match_id()
@@ -213,108 +233,176 @@ def fetch_matches(filename, game_mode, lobby_type, human_players=10, start_match
         return
     end_seq_num = end_match_result['match_seq_num']
     end_search_seq_num = end_seq_num + max_match_length
+    return search_start_seq_num, end_search_seq_num, start_match_id, end_match_id
+
+
+# Leaver statuses of players who did not abandon the match.
+NO_ABANDON_LEAVER_STATUS = frozenset((0, 1))
+DIRE_SLOT_BIT = 0x80  # Bit of a player slot which is set for Dire players.
+
+# Conditions matches are filtered by, with sets of allowed game modes and lobby types.
+PageFilter = namedtuple('PageFilter', ['game_modes', 'lobby_types', 'human_players', 'start_match_id',
+                                       'end_match_id'])
+
+
+def as_set(values):
+    """Return a frozenset of a single value or of a collection of values."""
+    try:
+        return frozenset(values)
+    except TypeError:
+        return frozenset((values,))
+
+
+def page_filter(game_mode, lobby_type, human_players, start_match_id, end_match_id):
+    """Return the PageFilter of the specified conditions, each of game_mode and lobby_type being a value or values."""
+    return PageFilter(as_set(game_mode), as_set(lobby_type), human_players, start_match_id, end_match_id)
+
+
+def match_rejection(m, conditions):
+    """Return the first of a PageFilter's conditions on the match itself which a match does not meet, or None."""
+    game_modes, lobby_types, human_players, start_match_id, end_match_id = conditions
+    for reason, condition in (('lobby_type', m['lobby_type'] in lobby_types),
+                              ('game_mode', m['game_mode'] in game_modes),
+                              ('match_id', start_match_id <= m['match_id'] <= end_match_id),
+                              ('human_players', m['human_players'] == human_players)):
+        if not condition:
+            return reason
+    return None
+
+
+def decode_page(api_matches, conditions, rejected=None):
+    """Return database entries for the matches in an API response which meet a PageFilter's conditions.
+
+    Matches with leavers or bots are rejected. Matches with heroes missing from the hero data are kept, and skipped
+    when processing them, so they are not lost before the hero data is updated. If a Counter is given as rejected,
+    the reason each match is rejected for is counted in it.
+    """
+    game_modes, lobby_types, human_players, start_match_id, end_match_id = conditions
+    page = []
+    for m in api_matches:
+        match_id = m['match_id']
+        if not (m['lobby_type'] in lobby_types and m['game_mode'] in game_modes and
+                start_match_id <= match_id <= end_match_id and m['human_players'] == human_players):
+            if rejected is not None:
+                rejected[match_rejection(m, conditions)] += 1
+            continue
+        # Check for leavers and create lists of hero picks for each team.
+        picks_radiant = []
+        picks_dire = []
+        for p in m['players']:
+            hero_id = p['hero_id']
+            leaver_status = p.get('leaver_status')
+            if leaver_status not in NO_ABANDON_LEAVER_STATUS:
+                reason = 'bot' if leaver_status is None else 'leaver'  # Bots do not have key 'leaver_status'.
+                break
+            if p['player_slot'] & DIRE_SLOT_BIT:
+                picks_dire.append(hero_id)
+            else:
+                picks_radiant.append(hero_id)
+        else:
+            picks_radiant.sort()
+            picks_dire.sort()
+            page.append({'match_id': match_id, 'match_seq_num': m['match_seq_num'], 'radiant_win': m['radiant_win'],
+                         'game_mode': m['game_mode'], 'lobby_type': m['lobby_type'],
+                         'picks_radiant': picks_radiant, 'picks_dire': picks_dire})
+            continue
+        if rejected is not None:
+            rejected[reason] += 1
+    return page
+
+
+def decode_history(body, conditions, end_seq_num=None):
+    """Return the result of a GetMatchHistoryBySequenceNum response body, with its matches decoded by decode_page.
+
+    The matches of the result are replaced by 'page', the database entries of the matches meeting the PageFilter's
+    conditions, 'rejected', the number of matches rejected for each reason, and 'seq_nums', the sequence numbers of
+    all the matches. If end_seq_num is given, only matches before it are decoded. Parsing the body takes most of the
+    time, so it is done here too, and this does not depend on the database, so responses can be decoded in other
+    processes.
+    """
+    result = json.loads(body)['result']
+    api_matches = result.pop('matches', [])
+    result['seq_nums'] = [m['match_seq_num'] for m in api_matches]
+    if end_seq_num is not None:
+        api_matches = [m for m in api_matches if m['match_seq_num'] < end_seq_num]
+    rejected = Counter()
+    result['page'] = decode_page(api_matches, conditions, rejected)
+    result['rejected'] = dict(rejected)
+    return result
+
+
+def fetch_page(seq_num, matches_requested, conditions, executor=None, end_seq_num=None):
+    """Return the result of a GetMatchHistoryBySequenceNum request decoded by decode_history.
+
+    The response is decoded in one of the executor's processes if one is given. The request is retried if the
+    response cannot be decoded.
+    """
+    for attempt in range(20):
+        response = get_match_history_by_seq_num(seq_num, matches_requested)
+        try:
+            if executor is None:
+                return decode_history(response.text, conditions, end_seq_num)
+            return executor.submit(decode_history, response.text, conditions, end_seq_num).result()
+        except json.JSONDecodeError:
+            print('JSONDecodeError. Waiting before retrying...')
+            time.sleep(30)
+    raise json.JSONDecodeError
+
+
+def new_page_matches(result, index):
+    """Return the matches of a decoded page which are not already in the indexed database.
+
+    The matches kept and rejected are added to the crawl metrics.
+    """
+    page = [m for m in result['page'] if not index_contains(index, m['match_id'])]
+    for reason, count in dict(result['rejected'], duplicate=len(result['page']) - len(page)).items():
+        if count:
+            crawler_metrics.count('matches_rejected_total', count, reason=reason)
+    crawler_metrics.count('matches_kept_total', len(page))
+    return page
 
-    # Read existing data.
+
+def fetch_matches(filename, game_mode, lobby_type, human_players=10, start_match_id=None, end_match_id=None):
+    """Fetch matches and write data to file if specified conditions are met."""
+    # Read index of existing data.
     try:
-        with open(filename) as data:
-            database = json.load(data)
-        data_size = database['data_size']
-        match_id_set = {m['match_id'] for m in database['matches']}
+        index = load_index(filename)
     except FileNotFoundError:
-        data_size = 0
-        match_id_set = set()
+        index = empty_index()
+    data_size = index['count']
+
+    search = search_range(index, start_match_id, end_match_id)
+    if search is None:
+        return
+    search_start_seq_num, end_search_seq_num, start_match_id, end_match_id = search
+    conditions = page_filter(game_mode, lobby_type, human_players, start_match_id, end_match_id)
 
     matches_requested = 100
-    no_abandon_leaver_status = {0, 1}
     new_matches_fetched = 0
     num_matches_fetched = 0
     new_matches = []
     seq_num = search_start_seq_num
     # Loop through GetMatchHistoryBySequenceNum responses from smallest to largest sequence number.
     while seq_num < end_search_seq_num:
-        for attempt in range(20):
-            try:
-                response = get_match_history_by_seq_num(seq_num, matches_requested)
-                decoded_response = response.json()
-            except json.JSONDecodeError:
-                print('JSONDecodeError. Waiting before retrying...')
-                time.sleep(30)
-                continue
-            break
-        else:
-            raise json.JSONDecodeError
-        result = decoded_response['result']
+        result = fetch_page(seq_num, matches_requested, conditions)
         # Check that response contains good data.
         if result['status'] == 1:
             # Add matches to database if specified conditions are met.
-            api_matches = result['matches']
-            for m in api_matches:
-                match_id = m['match_id']
-                match_seq_num = m['match_seq_num']
-
-                # Conditions:
-                match_lobby_type = m['lobby_type']
-                try:
-                    lobby_condition = match_lobby_type in lobby_type
-                except TypeError:
-                    lobby_condition = match_lobby_type == lobby_type
-                match_game_mode = m['game_mode']
-                try:
-                    mode_condition = match_game_mode in game_mode
-                except TypeError:
-                    mode_condition = match_game_mode == game_mode
-                conditions = (lobby_condition and mode_condition and start_match_id <= match_id <= end_match_id and
-                              m['human_players'] == human_players and match_id not in match_id_set)
-
-                if conditions:
-                    # Check for leavers and create lists of hero picks for each team.
-                    picks_radiant = []
-                    picks_dire = []
-                    for p in m['players']:
-                        try:
-                            if p['leaver_status'] not in no_abandon_leaver_status:
-                                leavers = True
-                                break
-                        except KeyError:  # Bots do not have key 'leaver_status'.
-                            leavers = True
-                            break
-                        player_slot = bin(p['player_slot'])[2:].zfill(8)  # int to 8-bit binary string.
-                        player_dire = int(player_slot[0])  # 0 is Radiant and 1 is Dire.
-                        hero_id = p['hero_id']
-                        if player_dire:
-                            picks_dire.append(hero_id)
-                        else:
-                            picks_radiant.append(hero_id)
-                    else:
-                        leavers = False
-                    picks_radiant.sort()
-                    picks_dire.sort()
-
-                    if not leavers:
-                        match = {'match_id': match_id, 'match_seq_num': match_seq_num, 'radiant_win': m['radiant_win'],
-                                 'game_mode': match_game_mode, 'lobby_type': match_lobby_type,
-                                 'picks_radiant': picks_radiant, 'picks_dire': picks_dire}
-                        new_matches.append(match)
-                        new_matches_fetched += 1
+            page = new_page_matches(result, index)
+            new_matches.extend(page)
+            new_matches_fetched += len(page)
 
             # Check if we are in the final loop.
-            seq_num = 1 + api_matches[-1]['match_seq_num']
-            final_loop = len(api_matches) < matches_requested or seq_num >= end_search_seq_num
+            seq_num = 1 + result['seq_nums'][-1]
+            final_loop = len(result['seq_nums']) < matches_requested or seq_num >= end_search_seq_num
 
             # Write database to file when enough matches have been fetched.
             if new_matches_fetched >= 5000 or final_loop:
-                try:
-                    with open(filename) as data:
-                        construct = json.load(data)
-                except FileNotFoundError:
-                    construct = {'data_size': 0, 'matches': []}
-                construct['data_size'] += new_matches_fetched
+                with crawler_metrics.timer('flush_duration_seconds', target='database'):
+                    append_matches(filename, new_matches, index)
                 num_matches_fetched += new_matches_fetched
                 new_matches_fetched = 0
-                construct['matches'].extend(new_matches)
                 new_matches = []
-                write_json_data(filename, construct)
-                del construct
 
             # Stop gathering data if we are in the final loop.
             if final_loop:
@@ -322,20 +410,166 @@ def fetch_matches(filename, game_mode, lobby_type, human_players=10, start_match
 
             # Print completion details about data fetched so far.
             completion = (seq_num - search_start_seq_num) / (end_search_seq_num - search_start_seq_num)
-            print(f'Progress: {completion:>7.3%} (sequence number {seq_num})')
+            eta = crawler_metrics.progress(seq_num - search_start_seq_num, end_search_seq_num - search_start_seq_num)
+            print(f'Progress: {completion:>7.3%} (sequence number {seq_num}, ETA {format_duration(eta)})')
+        else:
+            print(f'Sequence number {seq_num} statusDetail: ' + result['statusDetail'])
+            seq_num += 1
+
+    print(f'Fetched {num_matches_fetched} new matches.')
+    print(f'Total size is {data_size + num_matches_fetched} matches.')
+    print(f'Steam Web API requests: {steam_limiter.stats()}')
+
+
+def checkpoint_filename(filename):
+    return filename + '.crawl.json'
+
+
+def shard_filename(filename, shard):
+    return f'{filename}.shard{shard}'
+
+
+def write_checkpoint(filename, checkpoint):
+    temporary = checkpoint_filename(filename) + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(temporary, checkpoint_filename(filename))
+
+
+def fetch_shard(filename, checkpoint, checkpoint_lock, shard, conditions, index, executor=None, stop=None):
+    """Fetch the matches of one shard of the sequence number range into the shard's own file.
+
+    Pages are decoded with the PageFilter conditions, in the executor's processes if one is given. The checkpoint
+    records the next sequence number to fetch for the shard after each page is written, so an interrupted crawl
+    continues where it stopped. Fetching stops after the current page once the stop event is set.
+    """
+    matches_requested = 100
+    shard_state = checkpoint['shards'][shard]
+    seq_num = shard_state['next']
+    end_seq_num = shard_state['end']
+    while seq_num < end_seq_num and not (stop is not None and stop.is_set()):
+        # Pages may extend beyond the end of the shard, where the next shard starts.
+        result = fetch_page(seq_num, matches_requested, conditions, executor, end_seq_num)
+        if result['status'] == 1:
+            seq_nums = [s for s in result['seq_nums'] if s < end_seq_num]
+            page = new_page_matches(result, index)
+            if page:
+                with crawler_metrics.timer('flush_duration_seconds', target='shard'):
+                    append_matches(shard_filename(filename, shard), page)
+            if len(result['seq_nums']) < matches_requested or not seq_nums:
+                seq_num = end_seq_num
+            else:
+                seq_num = 1 + seq_nums[-1]
         else:
             print(f'Sequence number {seq_num} statusDetail: ' + result['statusDetail'])
             seq_num += 1
+        with checkpoint_lock:
+            shard_state['next'] = min(seq_num, end_seq_num)
+            write_checkpoint(filename, checkpoint)
+            remaining = sum(s['end'] - s['next'] for s in checkpoint['shards'])
+            total = checkpoint['search_end'] - checkpoint['search_start']
+            completion = 1 - remaining / total
+            eta = crawler_metrics.progress(total - remaining, total)
+        print(f'Progress: {completion:>7.3%} (shard {shard}, sequence number {seq_num}, ETA {format_duration(eta)})')
 
+
+def merge_shards(filename, checkpoint, index):
+    """Append the matches fetched by each shard to the database in sequence number order.
+
+    Return the number of matches added.
+    """
+    num_matches_fetched = 0
+    for shard in range(len(checkpoint['shards'])):
+        shard_file = shard_filename(filename, shard)
+        if not os.path.exists(shard_file):
+            continue
+        new_matches = []
+        new_ids = set()
+        for m in read_matches(shard_file):
+            # Skip pages written again after an interruption, and matches merged before an interrupted merge.
+            if m['match_id'] not in new_ids and not index_contains(index, m['match_id']):
+                new_matches.append(m)
+                new_ids.add(m['match_id'])
+        new_matches.sort(key=itemgetter('match_seq_num'))
+        for chunk_start in range(0, len(new_matches), 5000):
+            with crawler_metrics.timer('flush_duration_seconds', target='database'):
+                append_matches(filename, new_matches[chunk_start:chunk_start + 5000], index)
+        num_matches_fetched += len(new_matches)
+        os.remove(shard_file)
+    return num_matches_fetched
+
+
+def fetch_matches_concurrent(filename, game_mode, lobby_type, human_players=10, start_match_id=None,
+                             end_match_id=None, workers=4, shards=None, decode_workers=0):
+    """Fetch matches using several threads, each crawling shards of the sequence number range.
+
+    All threads share the Steam Web API rate limiter. Progress is checkpointed per shard, and an
+    interrupted crawl is resumed from its checkpoint before a new crawl is started. With decode_workers, responses
+    are decoded in a pool of that many processes shared by the threads, instead of in the threads.
+    """
+    try:
+        index = load_index(filename)
+    except FileNotFoundError:
+        index = empty_index()
+    data_size = index['count']
+
+    try:
+        with open(checkpoint_filename(filename)) as f:
+            checkpoint = json.load(f)
+        print(f'Resuming crawl from {checkpoint_filename(filename)}.')
+    except FileNotFoundError:
+        search = search_range(index, start_match_id, end_match_id)
+        if search is None:
+            return
+        search_start_seq_num, end_search_seq_num, start_match_id, end_match_id = search
+        if shards is None:
+            shards = 4 * workers
+        shard_size = max(1, -(-(end_search_seq_num - search_start_seq_num) // shards))
+        shard_starts = range(search_start_seq_num, end_search_seq_num, shard_size)
+        checkpoint = {'search_start': search_start_seq_num, 'search_end': end_search_seq_num,
+                      'start_match_id': start_match_id, 'end_match_id': end_match_id,
+                      'shards': [{'next': s, 'end': min(s + shard_size, end_search_seq_num)} for s in shard_starts]}
+        write_checkpoint(filename, checkpoint)
+
+    checkpoint_lock = threading.Lock()
+    stop = threading.Event()
+    conditions = page_filter(game_mode, lobby_type, human_players, checkpoint['start_match_id'],
+                             checkpoint['end_match_id'])
+    with ExitStack() as stack:
+        decoder = stack.enter_context(ProcessPoolExecutor(decode_workers)) if decode_workers else None
+        executor = stack.enter_context(ThreadPoolExecutor(max_workers=workers))
+        futures = [executor.submit(fetch_shard, filename, checkpoint, checkpoint_lock, shard, conditions, index,
+                                   decoder, stop)
+                   for shard in range(len(checkpoint['shards']))]
+        try:
+            for future in futures:
+                future.result()
+        except KeyboardInterrupt:
+            # Let the running shards finish their current page, and do not start the queued ones.
+            stop.set()
+            executor.shutdown(cancel_futures=True)
+            print(f'Crawl interrupted. Run again to resume it from {checkpoint_filename(filename)}.')
+            return
+
+    num_matches_fetched = merge_shards(filename, checkpoint, index)
+    os.remove(checkpoint_filename(filename))
     print(f'Fetched {num_matches_fetched} new matches.')
     print(f'Total size is {data_size + num_matches_fetched} matches.')
+    print(f'Steam Web API requests: {steam_limiter.stats()}')
+
+
+def crawl():
+    """Fetch matches with the settings in config.py, exporting the crawl's metrics while it runs."""
+    with export_metrics(crawler_metrics, config.METRICS_FILE, config.METRICS_INTERVAL,
+                        config.METRICS_PORT if config.serve_metrics else None):
+        if config.crawler_workers > 1:
+            fetch_matches_concurrent(config.MATCH_DATA_FILE, config.game_mode, config.lobby_type, config.human_players,
+                                     config.start_match_id, config.end_match_id, config.crawler_workers,
+                                     decode_workers=config.decode_workers)
+        else:
+            fetch_matches(config.MATCH_DATA_FILE, config.game_mode, config.lobby_type, config.human_players,
+                          config.start_match_id, config.end_match_id)
 
 
 if __name__ == '__main__':
-    fn = config.MATCH_DATA_FILE
-    mode = config.game_mode
-    lobby = config.lobby_type
-    players = config.human_players
-    start_id = config.start_match_id
-    end_id = config.end_match_id
-    fetch_matches(fn, mode, lobby, players, start_id, end_id)
+    crawl()
@@ -0,0 +1,208 @@
+"""Metrics of the match crawler.
+
+Counters, gauges and histograms are identified by a name and labels, e.g. the latency of requests to each API endpoint
+or the number of matches rejected for each reason. They can be written periodically to a file as JSON lines or served
+in the Prometheus text format by a local HTTP server, e.g. at http://127.0.0.1:8572/metrics.
+"""
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+import config
+
+# Upper bounds in seconds of the buckets of duration histograms.
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+
+
+def endpoint_name(url):
+    """Return the path of a request URL with IDs replaced by {id}, so requests to the same endpoint share metrics."""
+    parts = urlsplit(url)
+    return parts.netloc + re.sub(r'/\d+(?=/|$)', '/{id}', parts.path)
+
+
+def format_duration(seconds):
+    """Return a duration in seconds as h:mm:ss, or 'unknown' if it is None."""
+    if seconds is None:
+        return 'unknown'
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02}:{seconds:02}'
+
+
+class Metrics:
+    """Thread-safe collection of counters, gauges and histograms, with a rolling estimate of the crawl's progress.
+
+    Progress is the number of sequence numbers crawled out of the total, and its rate is measured over the last
+    `window` seconds.
+    """
+
+    def __init__(self, window=600.0):
+        self.window = window
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}  # (name, labels) -> [bucket counts, sum, count, bucket upper bounds]
+        self._progress = deque()  # (time, progress, matches kept) samples within the window.
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def count(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, buckets=DURATION_BUCKETS, **labels):
+        """Add a value, e.g. a duration in seconds, to a histogram."""
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.setdefault(key, [[0] * len(buckets), 0.0, 0, buckets])
+            histogram[0][bisect_left(buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Context manager adding the time taken by its block to a histogram."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def progress(self, done, total):
+        """Record the progress of the crawl and return the estimated number of seconds until it completes.
+
+        Returns None until the rate of progress can be measured.
+        """
+        now = time.monotonic()
+        with self._lock:
+            kept = sum(v for (name, _), v in self.counters.items() if name == 'matches_kept_total')
+            samples = self._progress
+            samples.append((now, done, kept))
+            while len(samples) > 2 and samples[1][0] < now - self.window:
+                samples.popleft()
+            elapsed = now - samples[0][0]
+            rate = (done - samples[0][1]) / elapsed if elapsed > 0 else 0.0
+            matches_per_hour = 3600 * (kept - samples[0][2]) / elapsed if elapsed > 0 else 0.0
+        eta = (total - done) / rate if rate > 0 else None
+        self.set_gauge('crawl_progress_ratio', done / total if total else 1.0)
+        self.set_gauge('crawl_matches_per_hour', matches_per_hour)
+        self.set_gauge('crawl_eta_seconds', math.nan if eta is None else eta)
+        return eta
+
+    def snapshot(self):
+        """Return the current values of all metrics as a dict which can be written as JSON."""
+        with self._lock:
+            return {'time': time.time(),
+                    'counters': [dict(name=n, labels=dict(l), value=v) for (n, l), v in sorted(self.counters.items())],
+                    'gauges': [dict(name=n, labels=dict(l), value=None if math.isnan(v) else v)
+                               for (n, l), v in sorted(self.gauges.items())],
+                    'histograms': [dict(name=n, labels=dict(l), buckets=dict(zip(map(str, h[3]), h[0])), sum=h[1],
+                                        count=h[2])
+                                   for (n, l), h in sorted(self.histograms.items())]}
+
+    def prometheus(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        def series(name, labels, **extra):
+            labels = dict(labels, **extra)
+            if not labels:
+                return name
+            return name + '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}'
+
+        lines = []
+        with self._lock:
+            for kind, values in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted({n for n, _ in values}):
+                    lines.append(f'# TYPE {name} {kind}')
+                    lines.extend(f'{series(name, l)} {v}' for (n, l), v in sorted(values.items()) if n == name)
+            for name in sorted({n for n, _ in self.histograms}):
+                lines.append(f'# TYPE {name} histogram')
+                for (n, l), (bucket_counts, total, count, buckets) in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for bound, bucket_count in zip(buckets, bucket_counts):
+                        cumulative += bucket_count
+                        le = '+Inf' if bound == math.inf else str(bound)
+                        lines.append(f'{series(name + "_bucket", l, le=le)} {cumulative}')
+                    lines.append(f'{series(name + "_sum", l)} {total}')
+                    lines.append(f'{series(name + "_count", l)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_json_line(self, filename):
+        with open(filename, 'a') as f:
+            f.write(json.dumps(self.snapshot()) + '\n')
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    metrics = None
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            status, body = 200, self.metrics.prometheus().encode()
+        else:
+            status, body = 404, b'Not found.\n'
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_metrics_server(metrics, port=config.METRICS_PORT):
+    """Return a server giving the metrics in the Prometheus text format at /metrics."""
+    handler = type('MetricsHandler', (MetricsHandler,), {'metrics': metrics})
+    return ThreadingHTTPServer(('127.0.0.1', port), handler)
+
+
+@contextmanager
+def export_metrics(metrics, filename=None, interval=60.0, port=None):
+    """Context manager exporting metrics while its block runs.
+
+    If a filename is given, a snapshot is appended to it as a JSON line every `interval` seconds and when the block
+    ends. If a port is given, the metrics are served on it in the Prometheus text format.
+    """
+    stop = threading.Event()
+    threads = []
+    server = None
+    if filename is not None:
+        def write_periodically():
+            while not stop.wait(interval):
+                metrics.write_json_line(filename)
+        threads.append(threading.Thread(target=write_periodically, daemon=True))
+    if port is not None:
+        server = create_metrics_server(metrics, port)
+        threads.append(threading.Thread(target=server.serve_forever, daemon=True))
+    for thread in threads:
+        thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        for thread in threads:
+            thread.join()
+        if filename is not None:
+            metrics.write_json_line(filename)
+
+
+# Metrics of all requests and crawls made by this process.
+crawler_metrics = Metrics()
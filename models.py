@@ -0,0 +1,110 @@
+"""Keras models predicting the winner of a draft, and streaming of training data to them with tf.data.
+
+This is the only module besides sweep.py which imports TensorFlow, so that the rest of the pipeline starts quickly.
+"""
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras import activations, constraints
+from tensorflow.keras.constraints import max_norm
+from tensorflow.keras.layers import Dense, Dropout, Layer
+from tensorflow.keras.models import Sequential
+from tensorflow.keras.optimizers import Adam
+
+from process import TEAM_SIZE, pick_dtype, read_training_data
+from train import draft_batches
+
+
+def training_dataset(directory, num_heroes, ranges, batch_size=65536, shuffle_buffer=2 ** 20, seed=None,
+                     input_mode='dense'):
+    """Return a tf.data.Dataset streaming batches of the matches in (start, stop) ranges of the training data from disk.
+
+    The training data is memory-mapped, so processes streaming the same training data share one copy in memory.
+    """
+    database = read_training_data(directory, unpack_results=False)
+    rng = np.random.default_rng(seed)
+    if input_mode == 'dense':
+        input_signature = tf.TensorSpec(shape=(None, num_heroes), dtype=tf.int8)
+    else:
+        input_dtype = tf.as_dtype(np.dtype(pick_dtype(num_heroes + 1)))
+        input_signature = tf.TensorSpec(shape=(None, 2 * TEAM_SIZE), dtype=input_dtype)
+    signature = (input_signature, tf.TensorSpec(shape=(None,), dtype=tf.int8))
+    dataset = tf.data.Dataset.from_generator(
+        lambda: draft_batches(database, ranges, num_heroes, batch_size, shuffle_buffer, rng, input_mode),
+        output_signature=signature)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def build_model(num_heroes, units=(128, 64), dropout=0.2, learning_rate=0.01):
+    """Return a model with hidden layers of the given numbers of units, each preceded by dropout."""
+    model = Sequential()
+    model.add(Dropout(dropout, input_shape=(num_heroes,)))
+    # model.add(Dense(128, activation='relu', input_dim=num_heroes))
+    model.add(Dense(units[0], activation='relu', kernel_constraint=max_norm(3)))
+    for layer_units in units[1:]:
+        model.add(Dropout(dropout))
+        model.add(Dense(layer_units, activation='relu', kernel_constraint=max_norm(3)))
+    model.add(Dropout(dropout))
+    model.add(Dense(1, activation='sigmoid'))
+
+    adam = Adam(lr=learning_rate)
+    model.compile(optimizer=adam, loss='binary_crossentropy', metrics=['accuracy'])
+    return model
+
+
+class DraftEmbedding(Layer):
+    """Sum of the embeddings of the radiant heroes minus those of the dire heroes, plus a bias.
+
+    Takes the picks vector columns of a draft's heroes, as given by train.encode_columns, and computes the same as a
+    Dense layer applied to the draft's picks vector, and a Dropout layer before it, without building the picks vector.
+    Hero indices of num_heroes or more are ignored.
+    """
+
+    def __init__(self, num_heroes, units, activation=None, rate=0.0, kernel_constraint=None, **kwargs):
+        super().__init__(**kwargs)
+        self.num_heroes = num_heroes
+        self.units = units
+        self.activation = activations.get(activation)
+        self.rate = rate
+        self.kernel_constraint = constraints.get(kernel_constraint)
+
+    def build(self, input_shape):
+        # Named and shaped like a Dense layer's weights, so export_weights treats both layers the same.
+        self.kernel = self.add_weight(name='kernel', shape=(self.num_heroes, self.units),
+                                      initializer='glorot_uniform', constraint=self.kernel_constraint)
+        self.bias = self.add_weight(name='bias', shape=(self.units,), initializer='zeros')
+        team_size = input_shape[-1] // 2
+        self.signs = tf.constant([1.0] * team_size + [-1.0] * team_size)
+
+    def call(self, inputs, training=None):
+        indices = tf.cast(inputs, tf.int32)
+        signs = self.signs * tf.cast(indices < self.num_heroes, tf.float32)
+        if training and self.rate:
+            signs = tf.nn.dropout(signs * tf.ones_like(indices, dtype=tf.float32), rate=self.rate)
+        embeddings = tf.gather(self.kernel, tf.minimum(indices, self.num_heroes - 1))
+        return self.activation(tf.einsum('bh,bhu->bu', signs, embeddings) + self.bias)
+
+    def get_config(self):
+        config_ = super().get_config()
+        config_.update(num_heroes=self.num_heroes, units=self.units, activation=activations.serialize(self.activation),
+                       rate=self.rate, kernel_constraint=constraints.serialize(self.kernel_constraint))
+        return config_
+
+
+def build_embedding_model(num_heroes, units=(128, 64), dropout=0.2, learning_rate=0.01):
+    """Return a model equivalent to the one built by build_model, taking the picked heroes' indices as input."""
+    model = Sequential()
+    model.add(DraftEmbedding(num_heroes, units[0], activation='relu', rate=dropout, kernel_constraint=max_norm(3),
+                             input_shape=(2 * TEAM_SIZE,)))
+    for layer_units in units[1:]:
+        model.add(Dropout(dropout))
+        model.add(Dense(layer_units, activation='relu', kernel_constraint=max_norm(3)))
+    model.add(Dropout(dropout))
+    model.add(Dense(1, activation='sigmoid'))
+
+    adam = Adam(lr=learning_rate)
+    model.compile(optimizer=adam, loss='binary_crossentropy', metrics=['accuracy'])
+    return model
+
+
+# Functions building a model for each input mode.
+MODELS = {'dense': build_model, 'indices': build_embedding_model}
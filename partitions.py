@@ -0,0 +1,322 @@
+"""Match data partitioned by patch and match ID range, so a window of matches can be read without scanning them all.
+
+Matches appended to the match database are copied into partitions: JSON Lines files (see database.py) of matches
+sorted by match ID, each holding matches of one patch and one range of PARTITION_MATCH_IDS match IDs. The patch of a
+match is found from the first match IDs of patches cached in PATCH_CACHE_FILE by matches.current_patch_match_id, and
+is None for matches older than any patch found. manifest.json lists each partition's patch, range, match count and
+minimum and maximum match IDs, and how much of the database has been partitioned and the match ID on its last line
+partitioned, so reading a window of match IDs only opens the partitions overlapping it.
+
+Each update writes new partitions for the matches appended since the last update, so a key (patch and range) may
+have several small partitions. Compaction merges the partitions of each key into one in a single sorted merge pass,
+dropping duplicate match IDs.
+"""
+import argparse
+import heapq
+from bisect import bisect_right
+from itertools import groupby, islice
+from operator import itemgetter
+import json
+import os
+
+import config
+from database import append_matches, match_ending_at, read_match_offsets, read_matches
+from hero_index import load_hero_index
+from matches import read_patch_cache
+from process import pick_dtype, read_training_meta, write_training_data
+
+MANIFEST_FILE = 'manifest.json'
+CHUNK_SIZE = 65536  # Matches read from the database or written to a partition at a time.
+
+
+def empty_manifest(range_size=config.PARTITION_MATCH_IDS):
+    return {'offset': 0, 'last_match_id': None, 'serial': 0, 'range_size': range_size, 'partitions': []}
+
+
+def read_manifest(directory):
+    """Return the manifest of the partitions in a directory, or an empty manifest if there are none."""
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE)) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return empty_manifest()
+
+
+def write_manifest(directory, manifest):
+    """Replace the manifest, only once it has been written in full."""
+    temporary = os.path.join(directory, MANIFEST_FILE + '.tmp')
+    with open(temporary, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+        manifest_file.flush()
+        os.fsync(manifest_file.fileno())
+    os.replace(temporary, os.path.join(directory, MANIFEST_FILE))
+
+
+def partition_filename(directory, partition):
+    return os.path.join(directory, partition['file'])
+
+
+def remove_unlisted(directory, manifest):
+    """Remove partitions not listed in the manifest, left by an interrupted update or compaction."""
+    listed = {p['file'] for p in manifest['partitions']}
+    for name in os.listdir(directory):
+        if name.endswith('.jsonl') and name not in listed:
+            os.remove(os.path.join(directory, name))
+
+
+def patch_bounds(boundaries):
+    """Return the first match IDs of the patches in the patch cache and the patches, sorted by match ID."""
+    first_match_ids, patches = zip(*sorted((m, p) for p, m in boundaries.items())) if boundaries else ((), ())
+    return list(first_match_ids), list(patches)
+
+
+def patch_of(match_id, bounds):
+    """Return the patch of a match ID, or None if it is older than the first match of every patch in bounds."""
+    first_match_ids, patches = bounds
+    position = bisect_right(first_match_ids, match_id)
+    return patches[position - 1] if position else None
+
+
+def patch_window(patch, cache_file=config.PATCH_CACHE_FILE):
+    """Return the first and last match IDs of a patch, the last being None if no later patch has been found."""
+    boundaries = read_patch_cache(cache_file)['boundaries']
+    if patch not in boundaries:
+        raise ValueError(f'The first match of patch {patch} is not in {cache_file}.')
+    later = [m for m in boundaries.values() if m > boundaries[patch]]
+    return boundaries[patch], min(later) - 1 if later else None
+
+
+def partition_key(match_id, bounds, range_size):
+    """Return the patch and the first match ID of the range of the partition a match belongs in."""
+    return patch_of(match_id, bounds), match_id // range_size * range_size
+
+
+def key_start(match_id, bounds, range_size):
+    """Return the smallest match ID with the same key as a match ID. Keys are in the same order as their first IDs."""
+    first_match_ids, _ = bounds
+    position = bisect_right(first_match_ids, match_id)
+    return max(first_match_ids[position - 1] if position else 0, match_id // range_size * range_size)
+
+
+def write_partitions(directory, manifest, matches, bounds):
+    """Write matches sorted by match ID to a new partition for each key and return the partitions' manifest entries.
+
+    The entries are not added to the manifest, but the serial number used to name partitions is advanced.
+    """
+    partitions = []
+    for (patch, range_start), key_matches in groupby(
+            matches, key=lambda m: partition_key(m['match_id'], bounds, manifest['range_size'])):
+        partition = {'file': f'{"unknown" if patch is None else patch}-{range_start}-{manifest["serial"]:06}.jsonl',
+                     'patch': patch, 'range_start': range_start, 'count': 0}
+        manifest['serial'] += 1
+        while True:
+            chunk = list(islice(key_matches, CHUNK_SIZE))
+            if not chunk:
+                break
+            append_matches(partition_filename(directory, partition), chunk)
+            partition.setdefault('min_match_id', chunk[0]['match_id'])
+            partition['max_match_id'] = chunk[-1]['match_id']
+            partition['count'] += len(chunk)
+        partitions.append(partition)
+    return partitions
+
+
+def update_partitions(database, directory, cache_file=config.PATCH_CACHE_FILE):
+    """Partition the matches appended to the database since the last update, and return the manifest.
+
+    New matches are read and partitioned in chunks, and the manifest is written after each chunk, so an interrupted
+    update resumes from the last chunk written. The partitions are rebuilt if the database has been replaced.
+    """
+    if not os.path.exists(database):
+        print('{} not found.'.format(database))
+        return None
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory)
+    last_match = match_ending_at(database, manifest['offset'])
+    if manifest['offset'] > 0 and (last_match is None or last_match['match_id'] != manifest.get('last_match_id')):
+        print(f'{database} has been replaced since it was partitioned. Partitioning it again.')
+        manifest = empty_manifest()
+        write_manifest(directory, manifest)
+    remove_unlisted(directory, manifest)
+    bounds = patch_bounds(read_patch_cache(cache_file)['boundaries'])
+    new_matches = read_match_offsets(database, manifest['offset'])
+    num_new_matches = 0
+    while True:
+        chunk = list(islice(new_matches, CHUNK_SIZE))
+        if not chunk:
+            break
+        unique_matches = sorted({m['match_id']: m for _, m in chunk}.values(), key=itemgetter('match_id'))
+        manifest['partitions'].extend(write_partitions(directory, manifest, unique_matches, bounds))
+        manifest['offset'] = chunk[-1][0]
+        manifest['last_match_id'] = chunk[-1][1]['match_id']
+        write_manifest(directory, manifest)
+        num_new_matches += len(chunk)
+    print(f'Partitioned {num_new_matches} new matches. {directory} contains {len(manifest["partitions"])} partitions.')
+    return manifest
+
+
+def merge_sorted(match_iterables):
+    """Yield the matches of iterables of matches sorted by match ID in match ID order, dropping duplicate match IDs."""
+    last_match_id = None
+    for m in heapq.merge(*match_iterables, key=itemgetter('match_id')):
+        if m['match_id'] != last_match_id:
+            last_match_id = m['match_id']
+            yield m
+
+
+def exclude_sorted(matches, excluded):
+    """Yield the matches whose match IDs are not those of the excluded matches, both sorted by match ID."""
+    excluded_ids = (m['match_id'] for m in excluded)
+    excluded_id = next(excluded_ids, None)
+    for m in matches:
+        while excluded_id is not None and excluded_id < m['match_id']:
+            excluded_id = next(excluded_ids, None)
+        if excluded_id != m['match_id']:
+            yield m
+
+
+def compact_partitions(directory, cache_file=config.PATCH_CACHE_FILE):
+    """Merge the partitions of each key into one, dropping duplicate match IDs, and return the manifest.
+
+    Partitions holding matches of several keys, as they do if the first match of a patch was found after they were
+    written, are merged with the partitions of all those keys and split by key. The new partitions are listed in the
+    manifest before the old ones are removed, so an interrupted compaction loses no matches.
+    """
+    manifest = read_manifest(directory)
+    if not manifest['partitions']:
+        print('No partitions in {}.'.format(directory))
+        return manifest
+    remove_unlisted(directory, manifest)
+    bounds = patch_bounds(read_patch_cache(cache_file)['boundaries'])
+    range_size = manifest['range_size']
+    # Groups of partitions sharing keys, found from the first match IDs of the keys each partition spans.
+    groups = []
+    for partition in sorted(manifest['partitions'], key=itemgetter('min_match_id')):
+        first_key, last_key = (key_start(partition[k], bounds, range_size) for k in ('min_match_id', 'max_match_id'))
+        if groups and first_key <= groups[-1][1]:
+            groups[-1][0].append(partition)
+            groups[-1][1] = max(groups[-1][1], last_key)
+        else:
+            groups.append([[partition], last_key])
+    kept, replaced, written = [], [], []
+    for partitions, _ in groups:
+        if len(partitions) == 1 and all(partition_key(partitions[0][k], bounds, range_size) ==
+                                        (partitions[0]['patch'], partitions[0]['range_start'])
+                                        for k in ('min_match_id', 'max_match_id')):
+            kept.extend(partitions)
+            continue
+        matches = merge_sorted(read_matches(partition_filename(directory, p)) for p in partitions)
+        written.extend(write_partitions(directory, manifest, matches, bounds))
+        replaced.extend(partitions)
+    manifest['partitions'] = sorted(kept + written, key=itemgetter('min_match_id'))
+    write_manifest(directory, manifest)
+    for partition in replaced:
+        os.remove(partition_filename(directory, partition))
+    duplicates = sum(p['count'] for p in replaced) - sum(p['count'] for p in written)
+    print(f'Compacted {len(replaced)} partitions into {len(written)}, dropping {duplicates} duplicate matches. '
+          f'{directory} contains {len(manifest["partitions"])} partitions.')
+    return manifest
+
+
+def select_partitions(manifest, start_match_id=None, end_match_id=None):
+    """Return the partitions with matches from start_match_id to end_match_id (None for no bound)."""
+    return [p for p in manifest['partitions']
+            if (start_match_id is None or p['max_match_id'] >= start_match_id) and
+            (end_match_id is None or p['min_match_id'] <= end_match_id)]
+
+
+def read_partitions(directory, start_match_id=None, end_match_id=None, partitions=None):
+    """Yield the matches from start_match_id to end_match_id (None for no bound) in match ID order, without duplicates.
+
+    Only the partitions overlapping the window are read, or the given partitions. Partitions which overlap each other
+    are merged, and the others are read one after another, so only overlapping partitions are open at once.
+    """
+    if partitions is None:
+        partitions = select_partitions(read_manifest(directory), start_match_id, end_match_id)
+    runs = []  # Lists of overlapping partitions, and the greatest match ID of each list.
+    for partition in sorted(partitions, key=itemgetter('min_match_id')):
+        if runs and partition['min_match_id'] <= runs[-1][1]:
+            runs[-1][0].append(partition)
+            runs[-1][1] = max(runs[-1][1], partition['max_match_id'])
+        else:
+            runs.append([[partition], partition['max_match_id']])
+    for run, _ in runs:
+        for m in merge_sorted(read_matches(partition_filename(directory, p)) for p in run):
+            if ((start_match_id is None or m['match_id'] >= start_match_id) and
+                    (end_match_id is None or m['match_id'] <= end_match_id)):
+                yield m
+
+
+def process_partitions(directory, output_file, start_match_id, end_match_id, incremental=True):
+    """Convert the matches from start_match_id to end_match_id to training data, reading only overlapping partitions.
+
+    If incremental and every partition converted by the last run still overlaps the window, only the partitions added
+    since are converted and appended to the training data, without the matches already converted from partitions
+    they overlap. Otherwise, e.g. after compaction, the training data is rebuilt from the partitions overlapping the
+    window.
+    """
+    manifest = read_manifest(directory)
+    if not manifest['partitions']:
+        print('No partitions in {}.'.format(directory))
+        return
+    try:
+        hero_index = load_hero_index()
+    except FileNotFoundError:
+        print('{} not found.'.format(config.HERO_DATA_FILE))
+        return
+    known_heroes = frozenset(hero_index.ids.tolist())
+    settings = {'partitions_directory': directory, 'start_match_id': start_match_id, 'end_match_id': end_match_id,
+                'hero_ids': sorted(known_heroes), 'pick_dtype': pick_dtype(len(known_heroes)), 'picks': 'columns'}
+    selected = select_partitions(manifest, start_match_id, end_match_id)
+    meta = read_training_meta(output_file)
+    if (incremental and meta is not None and all(meta.get(k) == v for k, v in settings.items()) and
+            set(meta['partitions']) <= {p['file'] for p in selected}):
+        converted = set(meta['partitions'])
+        count = meta['count']
+    else:
+        converted = set()
+        count = 0
+    new_partitions = [p for p in selected if p['file'] not in converted]
+    # Converted partitions which may hold matches also in the new partitions.
+    overlapping = [p for p in selected if p['file'] in converted and
+                   any(p['min_match_id'] <= n['max_match_id'] and n['min_match_id'] <= p['max_match_id']
+                       for n in new_partitions)]
+    new_meta = dict(settings, partitions=sorted(converted | {p['file'] for p in new_partitions}))
+
+    unknown_hero_matches = 0
+
+    def new_matches():
+        nonlocal unknown_hero_matches
+        for m in exclude_sorted(read_partitions(directory, start_match_id, end_match_id, new_partitions),
+                                read_partitions(directory, start_match_id, end_match_id, overlapping)):
+            if known_heroes.issuperset(m['picks_radiant']) and known_heroes.issuperset(m['picks_dire']):
+                yield m
+            else:
+                unknown_hero_matches += 1
+
+    new_count = write_training_data(output_file, new_matches(), settings['pick_dtype'], hero_index.columns, count,
+                                    meta=new_meta)
+    print(f'Processed {new_count - count} new matches from {len(new_partitions)} of {len(manifest["partitions"])} '
+          f'partitions. Training data contains {new_count} matches.')
+    if unknown_hero_matches:
+        print(f'WARNING: Skipped {unknown_hero_matches} matches with heroes not in {config.HERO_DATA_FILE}, '
+              f'which is out of date. Run "python heroes.py" to update it and include them.')
+
+
+def training_window(patch=None):
+    """Return the first and last match IDs of the training data: those of a patch if given, or those in config.py."""
+    if patch is not None:
+        return patch_window(patch)
+    return config.training_start_match_id, config.training_end_match_id
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Partition the match database and process a window of it.')
+    parser.add_argument('--compact', action='store_true', help='merge the partitions of each key')
+    parser.add_argument('--patch', type=int, default=config.training_patch, help='process only matches of a patch')
+    args = parser.parse_args()
+    update_partitions(config.MATCH_DATA_FILE, config.MATCH_PARTITIONS_DIRECTORY)
+    if args.compact:
+        compact_partitions(config.MATCH_PARTITIONS_DIRECTORY)
+    start_id, end_id = training_window(args.patch)
+    process_partitions(config.MATCH_PARTITIONS_DIRECTORY, config.TRAINING_DATA_FILE, start_id, end_id)
@@ -1,7 +1,29 @@
-"""Process raw match data in preparation for training."""
+"""Process raw match data in preparation for training.
+
+Training data is stored in a directory of raw little-endian arrays which can be memory-mapped:
+    picks_radiant.bin, picks_dire.bin  picks vector columns (see hero_index.py) of the heroes picked by each team,
+                                       shape (N, 5), uint8 or uint16
+    radiant_win.bin                    match results, bit-packed with numpy.packbits
+    match_ids.bin                      match IDs, int64
+meta.json gives N, the dtype of the picks, which is chosen from the number of heroes in the hero data file, and the
+settings and position in the match database of the last run. It is written after the arrays, so arrays extending
+beyond N after an interrupted run are truncated by the next run.
+"""
+from contextlib import ExitStack
+from itertools import islice
 import json
+import math
+import os
+
+import numpy as np
 
 import config
+from database import match_ending_at, read_match_offsets
+from hero_index import load_hero_index
+
+TEAM_SIZE = 5
+MATCH_ID_DTYPE = '<i8'
+CHUNK_SIZE = 65536  # Matches converted at a time.
 
 
 def write_json_data(filename, data):
@@ -20,33 +42,171 @@ def match_id_condition(match_id, start, end):
         return match_id <= end
 
 
-def process_data(input_file, output_file, start_match_id, end_match_id):
-    """Convert raw data into format suitable for training and write this data to file.
+def training_data_filename(directory, name):
+    return os.path.join(directory, name + '.bin')
+
 
-    Overwrite existing training data file.
+def pick_dtype(num_heroes):
+    """Return the smallest dtype able to store the picks vector columns of num_heroes heroes."""
+    return '<u1' if num_heroes - 1 <= np.iinfo(np.uint8).max else '<u2'
+
+
+def training_chunk(matches, pick_dtype, columns):
+    """Return the training data arrays for a list of matches, with results not yet bit-packed.
+
+    Hero IDs are converted to picks vector columns with the columns array of a HeroIndex.
     """
+    picks_radiant = columns[np.array([m['picks_radiant'] for m in matches]).reshape(-1, TEAM_SIZE)]
+    picks_dire = columns[np.array([m['picks_dire'] for m in matches]).reshape(-1, TEAM_SIZE)]
+    return {'picks_radiant': picks_radiant.astype(pick_dtype), 'picks_dire': picks_dire.astype(pick_dtype),
+            'radiant_win': np.array([m['radiant_win'] for m in matches], dtype=bool),
+            'match_ids': np.array([m['match_id'] for m in matches], dtype=MATCH_ID_DTYPE)}
+
+
+def write_training_data(directory, matches, pick_dtype, columns, count=0, meta=None):
+    """Write training data for an iterable of matches to a directory and return the number of matches stored.
+
+    Hero IDs are converted to picks vector columns with the columns array of a HeroIndex. The matches are written
+    after the first `count` matches already stored, overwriting any others. Matches are converted and written in
+    chunks of CHUNK_SIZE, so memory use does not depend on the number of matches. Items of `meta` are stored in
+    meta.json along with the number of matches and the pick dtype.
+    """
+    os.makedirs(directory, exist_ok=True)
+    item_sizes = {'picks_radiant': TEAM_SIZE * np.dtype(pick_dtype).itemsize,
+                  'picks_dire': TEAM_SIZE * np.dtype(pick_dtype).itemsize,
+                  'radiant_win': 1 / 8,
+                  'match_ids': np.dtype(MATCH_ID_DTYPE).itemsize}
+    with ExitStack() as stack:
+        files = {}
+        for name, item_size in item_sizes.items():
+            f = stack.enter_context(open(training_data_filename(directory, name), 'r+b' if count else 'wb'))
+            # The partly filled final byte of packed results is kept, to be read back below.
+            f.truncate(math.ceil(count * item_size))
+            f.seek(0, os.SEEK_END)
+            files[name] = f
+        # Results of matches in a partly filled final byte are packed again with the new results.
+        radiant_win_carry = np.zeros(0, dtype=bool)
+        if count % 8:
+            radiant_win_file = files['radiant_win']
+            radiant_win_file.seek(count // 8)
+            radiant_win_carry = np.unpackbits(np.frombuffer(radiant_win_file.read(1), dtype=np.uint8),
+                                              count=count % 8).astype(bool)
+            radiant_win_file.truncate(count // 8)
+            radiant_win_file.seek(0, os.SEEK_END)
+
+        matches = iter(matches)
+        while True:
+            chunk = list(islice(matches, CHUNK_SIZE))
+            if not chunk:
+                break
+            arrays = training_chunk(chunk, pick_dtype, columns)
+            radiant_win = np.concatenate((radiant_win_carry, arrays.pop('radiant_win')))
+            packed_length = radiant_win.size - radiant_win.size % 8
+            arrays['radiant_win'] = np.packbits(radiant_win[:packed_length])
+            radiant_win_carry = radiant_win[packed_length:]
+            for name, array in arrays.items():
+                array.tofile(files[name])
+            count += len(chunk)
+            del chunk, arrays  # Free the chunk before reading the next one.
+        np.packbits(radiant_win_carry).tofile(files['radiant_win'])
+    write_json_data(os.path.join(directory, 'meta.json'), dict(meta or {}, count=count, pick_dtype=pick_dtype))
+    return count
+
+
+def read_training_meta(directory):
+    """Return the contents of the training data's meta.json, or None if there is no training data."""
     try:
-        with open(input_file) as data_file:
-            in_data = json.load(data_file)
+        with open(os.path.join(directory, 'meta.json')) as meta_file:
+            return json.load(meta_file)
     except FileNotFoundError:
+        return None
+
+
+def read_training_data(directory, unpack_results=True):
+    """Return the arrays of training data stored in a directory, memory-mapping the picks and match IDs.
+
+    Match results are unpacked into a bool array, unless unpack_results is False, in which case the bit-packed
+    results are memory-mapped too and may be unpacked in parts with read_results.
+    """
+    meta = read_training_meta(directory)
+    if meta is None:
+        raise FileNotFoundError(f'No training data in {directory}.')
+    count = meta['count']
+    pick_dtype = meta['pick_dtype']
+
+    def memmap(name, dtype, shape):
+        if count == 0:  # Empty files cannot be memory-mapped.
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(training_data_filename(directory, name), dtype=dtype, mode='r', shape=shape)
+
+    packed = memmap('radiant_win', np.uint8, (-(-count // 8),))
+    return {'picks_radiant': memmap('picks_radiant', pick_dtype, (count, TEAM_SIZE)),
+            'picks_dire': memmap('picks_dire', pick_dtype, (count, TEAM_SIZE)),
+            'radiant_win': read_results(packed, 0, count) if unpack_results else packed,
+            'match_ids': memmap('match_ids', MATCH_ID_DTYPE, (count,))}
+
+
+def read_results(packed, start, stop):
+    """Return the results of matches start to stop from bit-packed match results as a bool array."""
+    bits = np.unpackbits(packed[start // 8:-(-stop // 8)])
+    return bits[start % 8:start % 8 + stop - start].astype(bool)
+
+
+def watermark_matches(input_file, meta):
+    """Return whether the last match converted into the training data still ends at the offset recorded for it."""
+    if meta['offset'] == 0:
+        return True
+    last_match = match_ending_at(input_file, meta['offset'])
+    return last_match is not None and last_match['match_id'] == meta['last_match_id']
+
+
+def process_data(input_file, output_file, start_match_id, end_match_id, incremental=True):
+    """Convert raw data into format suitable for training and write this data to file.
+
+    If incremental, only matches added to the database since the last run are converted and appended to the existing
+    training data. The training data is rebuilt if the match ID range or the set of heroes has changed, or if the
+    database has been replaced, so the match ending at the recorded offset is not the last one converted.
+    """
+    if not os.path.exists(input_file):
         print('{} not found.'.format(input_file))
         return
-    radiant = []
-    dire = []
-    labels = []
-    match_ids = []
-    for m in in_data['matches']:
-        match_id = m['match_id']
-        if match_id_condition(match_id, start_match_id, end_match_id):
-            picks_radiant = m['picks_radiant']
-            picks_dire = m['picks_dire']
-            radiant_win = m['radiant_win']
-            radiant.append(picks_radiant)
-            dire.append(picks_dire)
-            labels.append(radiant_win)
-            match_ids.append(match_id)
-    processed = {'picks_radiant': radiant, 'picks_dire': dire,  'radiant_win': labels, 'match_ids': match_ids}
-    write_json_data(output_file, processed)
+    try:
+        hero_index = load_hero_index()
+    except FileNotFoundError:
+        print('{} not found.'.format(config.HERO_DATA_FILE))
+        return
+    known_heroes = frozenset(hero_index.ids.tolist())
+    settings = {'start_match_id': start_match_id, 'end_match_id': end_match_id, 'hero_ids': sorted(known_heroes),
+                'pick_dtype': pick_dtype(len(known_heroes)), 'picks': 'columns'}
+    meta = read_training_meta(output_file)
+    if (incremental and meta is not None and all(meta.get(k) == v for k, v in settings.items()) and
+            'offset' in meta and watermark_matches(input_file, meta)):
+        watermark = {k: meta[k] for k in ('offset', 'last_match_id', 'last_seq_num')}
+        count = meta['count']
+    else:
+        watermark = {'offset': 0, 'last_match_id': None, 'last_seq_num': None}
+        count = 0
+    # Updated as matches are read, and written to meta.json once they have been converted.
+    new_meta = dict(settings, **watermark)
+
+    unknown_hero_matches = 0
+
+    def new_matches():
+        nonlocal unknown_hero_matches
+        for offset, m in read_match_offsets(input_file, new_meta['offset']):
+            new_meta.update(offset=offset, last_match_id=m['match_id'], last_seq_num=m['match_seq_num'])
+            if match_id_condition(m['match_id'], start_match_id, end_match_id):
+                if known_heroes.issuperset(m['picks_radiant']) and known_heroes.issuperset(m['picks_dire']):
+                    yield m
+                else:
+                    unknown_hero_matches += 1
+
+    new_count = write_training_data(output_file, new_matches(), settings['pick_dtype'], hero_index.columns, count,
+                                    meta=new_meta)
+    print(f'Processed {new_count - count} new matches. Training data contains {new_count} matches.')
+    if unknown_hero_matches:
+        print(f'WARNING: Skipped {unknown_hero_matches} matches with heroes not in {config.HERO_DATA_FILE}, '
+              f'which is out of date. Run "python heroes.py" to update it and include them.')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,123 @@
+"""Rate limiting of API requests."""
+import asyncio
+from email.utils import parsedate_to_datetime
+import random
+import threading
+import time
+
+import requests
+
+import config
+from metrics import crawler_metrics
+
+
+def retry_after_seconds(response):
+    """Return the delay requested by a response's Retry-After header in seconds, or None if there is none."""
+    retry_after = response.headers.get('Retry-After')
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_time = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_time.timestamp() - time.time())
+
+
+class RateLimiter:
+    """Token bucket rate limiter shared by all threads making requests to an API.
+
+    Tokens are added at `rate` per second up to a maximum of `burst`. Each request takes a token, waiting for one if
+    none are left. When a request is throttled, fails to connect or times out, all requests through the limiter are
+    paused, for the time given by the Retry-After header if there is one and otherwise for an exponentially increasing
+    time with random jitter. Waits and pauses are added to the metrics of the limiter's name.
+    """
+
+    def __init__(self, rate, burst=1, backoff_base=1.0, backoff_max=300.0, name='api'):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._failures = 0
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.throttles = 0
+        self.connection_errors = 0
+        self.time_slept = 0.0
+
+    def _reserve(self):
+        """Take a token and return the time to wait before making the request."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1  # A negative number of tokens reserves tokens which have not been added yet.
+            wait = max(0.0, -self._tokens / self.rate, self._paused_until - now)
+            self.requests += 1
+            self.time_slept += wait
+        crawler_metrics.count('ratelimit_wait_seconds_total', wait, api=self.name)
+        return wait
+
+    def acquire(self):
+        """Wait until a request may be made."""
+        time.sleep(self._reserve())
+
+    async def acquire_async(self):
+        """Wait until a request may be made without blocking the event loop."""
+        await asyncio.sleep(self._reserve())
+
+    def backoff(self, retry_after=None, throttled=True):
+        """Pause requests after a throttled or failed request and return the length of the pause in seconds."""
+        with self._lock:
+            if throttled:
+                self.throttles += 1
+            else:
+                self.connection_errors += 1
+            self._failures += 1
+            if retry_after is None:
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (self._failures - 1))
+                delay = random.uniform(delay / 2, delay)
+            else:
+                delay = retry_after
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        crawler_metrics.count('ratelimit_backoffs_total', api=self.name,
+                              reason='throttled' if throttled else 'connection_error')
+        return delay
+
+    def succeeded(self):
+        """Reset the backoff after a successful request."""
+        with self._lock:
+            self._failures = 0
+
+    def request(self, request_function, *args, **kwargs):
+        """Make a request once allowed, retrying throttled requests, connection errors and timeouts."""
+        while True:
+            self.acquire()
+            try:
+                response = request_function(*args, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as error:
+                delay = self.backoff(throttled=False)
+                print(f'{type(error).__name__}. Waiting {delay:.1f} seconds before retrying.')
+                continue
+            status = response.status_code
+            if status == 429 or status == 503:  # 429 Too Many Requests, 503 Service Unavailable.
+                delay = self.backoff(retry_after_seconds(response))
+                print(f'HTTP status code: {status}. Waiting {delay:.1f} seconds before retrying.')
+                continue
+            self.succeeded()
+            return response
+
+    def stats(self):
+        return {'requests': self.requests, 'throttles': self.throttles, 'connection_errors': self.connection_errors,
+                'time_slept': self.time_slept}
+
+
+steam_limiter = RateLimiter(config.STEAM_REQUEST_RATE, config.STEAM_REQUEST_BURST, name='steam')
+opendota_limiter = RateLimiter(config.OPENDOTA_REQUEST_RATE, config.OPENDOTA_REQUEST_BURST, name='opendota')
@@ -0,0 +1,186 @@
+"""Local draft-serving daemon.
+
+Loads the model weights exported by train.py and the hero data once, then answers scoring requests over HTTP. Drafts
+from concurrent requests are batched together into single forward passes of the model.
+
+POST /score      {"drafts": [{"radiant": [...], "dire": [...]}, ...]}  -> {"radiant_win": [...]}
+POST /recommend  {"radiant": [...], "dire": [...], "side": "radiant", "k": 10, "depth": 1}  -> {"picks": [[id, p], ...]}
+GET  /stats      latency percentiles, throughput and batch sizes
+"""
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import queue
+import threading
+import time
+
+import numpy as np
+
+import config
+from draft import recommend, search
+from inference import numpy_predict
+from hero_index import load_hero_index
+from process import TEAM_SIZE
+
+
+class Batcher:
+    """Collects batches of picks vectors submitted by many threads and scores them together.
+
+    A batch is scored once max_batch vectors have been collected or max_wait seconds after its first request.
+    """
+
+    def __init__(self, predict, max_batch, max_wait):
+        self.predict = predict
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.batch_rows = 0
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, batch):
+        """Return the radiant win probabilities of a batch of picks vectors."""
+        future = Future()
+        self.requests.put((batch, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            pending = [self.requests.get()]
+            rows = len(pending[0][0])
+            deadline = time.perf_counter() + self.max_wait
+            while rows < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+                rows += len(pending[-1][0])
+            try:
+                radiant_win = np.asarray(self.predict(np.concatenate([batch for batch, _ in pending])))
+            except Exception as error:
+                for _, future in pending:
+                    future.set_exception(error)
+                continue
+            self.batches += 1
+            self.batch_rows += rows
+            start = 0
+            for batch, future in pending:
+                future.set_result(radiant_win[start:start + len(batch)])
+                start += len(batch)
+
+
+class Stats:
+    """Latencies of recent requests and request throughput since the server started."""
+
+    def __init__(self, size=10000):
+        self.latencies = deque(maxlen=size)
+        self.requests = 0
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def record(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+            self.requests += 1
+
+    def summary(self, batcher):
+        with self.lock:
+            latencies = np.array(self.latencies)
+            requests = self.requests
+        summary = {'requests': requests, 'requests_per_second': requests / (time.perf_counter() - self.started),
+                   'batches': batcher.batches, 'mean_batch_rows': batcher.batch_rows / max(1, batcher.batches)}
+        if latencies.size:
+            summary['p50_ms'], summary['p99_ms'] = (1000 * np.percentile(latencies, (50, 99))).tolist()
+        return summary
+
+
+class DraftHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    batcher = None
+    stats = None
+    hero_ids = None
+    known_heroes = None
+    hero_matrix = None
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self.send_json(200, self.stats.summary(self.batcher))
+        else:
+            self.send_json(404, {'error': 'Not found.'})
+
+    def do_POST(self):
+        start = time.perf_counter()
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            if self.path == '/score':
+                response = {'radiant_win': self.score(request['drafts']).tolist()}
+            elif self.path == '/recommend':
+                response = {'picks': self.recommend(request)}
+            else:
+                self.send_json(404, {'error': 'Not found.'})
+                return
+        except (KeyError, TypeError, ValueError, IndexError) as error:
+            self.send_json(400, {'error': f'{type(error).__name__}: {error}'})
+            return
+        self.send_json(200, response)
+        self.stats.record(time.perf_counter() - start)
+
+    def validate_draft(self, radiant, dire):
+        """Raise ValueError unless the draft has known, distinct heroes and at most TEAM_SIZE picks per team."""
+        for team, picks in (('radiant', radiant), ('dire', dire)):
+            if len(picks) > TEAM_SIZE:
+                raise ValueError(f'{team} has {len(picks)} picks, more than {TEAM_SIZE}.')
+            unknown = [h for h in picks if h not in self.known_heroes]
+            if unknown:
+                raise ValueError(f'Unknown hero IDs picked by {team}: {unknown}.')
+        if len(set(radiant) | set(dire)) < len(radiant) + len(dire):
+            raise ValueError('A hero is picked more than once.')
+
+    def score(self, drafts):
+        hero_columns = load_hero_index().columns
+        batch = np.zeros((len(drafts), self.hero_matrix.shape[1]), dtype=self.hero_matrix.dtype)
+        for d in drafts:
+            self.validate_draft(d['radiant'], d['dire'])
+        for row, d in enumerate(drafts):
+            batch[row, hero_columns[d['radiant']]] = 1
+            batch[row, hero_columns[d['dire']]] = -1
+        return self.batcher.submit(batch)
+
+    def recommend(self, request):
+        radiant, dire, side = request['radiant'], request['dire'], request.get('side', 'radiant')
+        k, depth = request.get('k', 10), request.get('depth', 1)
+        self.validate_draft(radiant, dire)
+        if depth > 1:
+            return search(radiant, dire, side, self.batcher.submit, self.hero_ids, self.hero_matrix, depth=depth, k=k)
+        return recommend(radiant, dire, side, self.batcher.submit, self.hero_ids, self.hero_matrix, k=k)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_server(predict, port=config.SERVER_PORT):
+    """Return a server scoring drafts with predict, which maps picks vectors to radiant win probabilities."""
+    hero_index = load_hero_index()
+    batcher = Batcher(predict, config.SERVER_MAX_BATCH, config.SERVER_MAX_WAIT)
+    handler = type('DraftHandler', (DraftHandler,), {
+        'batcher': batcher, 'stats': Stats(), 'hero_ids': hero_index.ids.tolist(),
+        'known_heroes': frozenset(hero_index.ids.tolist()), 'hero_matrix': hero_index.one_hot})
+    return ThreadingHTTPServer(('127.0.0.1', port), handler)
+
+
+if __name__ == '__main__':
+    draft_server = create_server(numpy_predict(config.WEIGHTS_FILE))
+    print(f'Serving drafts on http://127.0.0.1:{draft_server.server_port}')
+    draft_server.serve_forever()
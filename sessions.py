@@ -0,0 +1,63 @@
+"""Shared HTTP session used for all API requests.
+
+Reusing one session keeps connections to each API host open between requests, instead of making a new TLS
+connection for every request.
+"""
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+from metrics import crawler_metrics, endpoint_name
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def create_session():
+    """Return a new session with connection pooling and compressed responses enabled."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=config.HTTP_POOL_SIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+    return session
+
+
+def get_session():
+    """Return the shared session, creating it if necessary."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+
+def set_session(session):
+    """Replace the shared session, e.g. with one that records or fakes responses. Return the previous session."""
+    global _session
+    with _session_lock:
+        previous = _session
+        _session = session
+    return previous
+
+
+def get(url, **kwargs):
+    """Send a GET request using the shared session and the configured timeouts.
+
+    The latency and status of the request are added to the metrics of its endpoint.
+    """
+    kwargs.setdefault('timeout', (config.HTTP_CONNECT_TIMEOUT, config.HTTP_READ_TIMEOUT))
+    endpoint = endpoint_name(url)
+    start = time.perf_counter()
+    try:
+        response = get_session().get(url, **kwargs)
+    except requests.exceptions.RequestException as error:
+        crawler_metrics.count('http_requests_total', endpoint=endpoint, status=type(error).__name__)
+        raise
+    finally:
+        crawler_metrics.observe('http_request_duration_seconds', time.perf_counter() - start, endpoint=endpoint)
+    crawler_metrics.count('http_requests_total', endpoint=endpoint, status=str(response.status_code))
+    return response
@@ -0,0 +1,193 @@
+"""Hero win rate, synergy and counter statistics counted from the training data.
+
+For H heroes, indexed by picks vector column (see hero_index.py), the counts are:
+    games, wins                  (H,) games played and won by each hero
+    pair_games, pair_wins        (H, H) games played and won by each pair of heroes on the same team
+    matchup_games, matchup_wins  (H, H) games in which the row hero played against the column hero, and won
+The counts are accumulated a chunk of matches at a time and saved along with the number of training data matches they
+cover, so later runs only count the matches processed since.
+
+Synergies and counters are given as log-odds of winning beyond those expected from the heroes' own win rates, and can
+be summed into a baseline model of a draft's outcome (see baseline_predict).
+"""
+import os
+
+import numpy as np
+
+import config
+from hero_index import load_hero_index
+from process import CHUNK_SIZE, read_results, read_training_data, read_training_meta
+
+# Games at the expected win rate added to each count, so rarely seen heroes and pairs have moderate statistics.
+PRIOR_GAMES = 10
+
+
+def empty_stats(hero_ids):
+    num_heroes = len(hero_ids)
+    return {'hero_ids': np.asarray(hero_ids, dtype=np.int64), 'count': 0, 'last_match_id': -1, 'radiant_wins': 0,
+            'games': np.zeros(num_heroes, dtype=np.int64), 'wins': np.zeros(num_heroes, dtype=np.int64),
+            'pair_games': np.zeros((num_heroes, num_heroes), dtype=np.int64),
+            'pair_wins': np.zeros((num_heroes, num_heroes), dtype=np.int64),
+            'matchup_games': np.zeros((num_heroes, num_heroes), dtype=np.int64),
+            'matchup_wins': np.zeros((num_heroes, num_heroes), dtype=np.int64)}
+
+
+def count_pairs(first, second, num_heroes, same_team=False):
+    """Return the (H, H) counts of pairs of picks vector columns taken from the same rows of first and second.
+
+    If same_team, first and second are the same team and a hero is not paired with itself.
+    """
+    pairs = first[:, :, np.newaxis] * num_heroes + second[:, np.newaxis, :]
+    if same_team:
+        pairs = pairs[:, ~np.eye(first.shape[1], dtype=bool)]
+    return np.bincount(pairs.ravel(), minlength=num_heroes ** 2).reshape(num_heroes, num_heroes)
+
+
+def accumulate_stats(stats, picks_radiant, picks_dire, radiant_win):
+    """Add the counts of a chunk of matches, given as arrays of picks vector columns and results, to stats."""
+    num_heroes = stats['games'].size
+    picks_radiant = np.asarray(picks_radiant, dtype=np.intp)
+    picks_dire = np.asarray(picks_dire, dtype=np.intp)
+    radiant_win = np.asarray(radiant_win, dtype=bool)
+    for team, enemy, won in ((picks_radiant, picks_dire, radiant_win), (picks_dire, picks_radiant, ~radiant_win)):
+        winners, losers = team[won], enemy[won]
+        stats['games'] += np.bincount(team.ravel(), minlength=num_heroes)
+        stats['wins'] += np.bincount(winners.ravel(), minlength=num_heroes)
+        stats['pair_games'] += count_pairs(team, team, num_heroes, same_team=True)
+        stats['pair_wins'] += count_pairs(winners, winners, num_heroes, same_team=True)
+        stats['matchup_games'] += count_pairs(team, enemy, num_heroes)
+        stats['matchup_wins'] += count_pairs(winners, losers, num_heroes)
+    stats['radiant_wins'] += int(radiant_win.sum())
+    stats['count'] += radiant_win.size
+
+
+def write_stats(filename, stats):
+    temporary = filename + '.tmp'
+    with open(temporary, 'wb') as stats_file:
+        np.savez(stats_file, **stats)
+    os.replace(temporary, filename)
+
+
+def read_stats(filename):
+    """Return the statistics stored in a file, or None if there are none."""
+    try:
+        with np.load(filename) as stored:
+            stats = {k: stored[k] for k in stored.files}
+    except FileNotFoundError:
+        return None
+    for key in ('count', 'last_match_id', 'radiant_wins'):
+        stats[key] = int(stats[key])
+    return stats
+
+
+def update_stats(training_directory, filename, incremental=True):
+    """Count the statistics of the training data, save them to file and return them.
+
+    If incremental, only matches added to the training data since the statistics were saved are counted. The counts
+    are started again if the training data has been rebuilt or its heroes have changed.
+    """
+    meta = read_training_meta(training_directory)
+    if meta is None:
+        print('{} not found.'.format(training_directory))
+        return None
+    database = read_training_data(training_directory, unpack_results=False)
+    count = meta['count']
+    stats = read_stats(filename) if incremental else None
+    if (stats is None or stats['hero_ids'].tolist() != meta['hero_ids'] or stats['count'] > count or
+            (stats['count'] and database['match_ids'][stats['count'] - 1] != stats['last_match_id'])):
+        stats = empty_stats(meta['hero_ids'])
+    previous_count = stats['count']
+    for start in range(previous_count, count, CHUNK_SIZE):
+        stop = min(start + CHUNK_SIZE, count)
+        accumulate_stats(stats, database['picks_radiant'][start:stop], database['picks_dire'][start:stop],
+                         read_results(database['radiant_win'], start, stop))
+    if count:
+        stats['last_match_id'] = int(database['match_ids'][count - 1])
+    write_stats(filename, stats)
+    print(f'Counted {count - previous_count} new matches. Statistics cover {count} matches.')
+    return stats
+
+
+def log_odds(p):
+    return np.log(p) - np.log1p(-p)
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def smoothed_log_odds(wins, games, expected, prior_games=PRIOR_GAMES):
+    """Return the log-odds of winning from counts, adding prior_games games at the expected log-odds."""
+    return log_odds((wins + prior_games * sigmoid(expected)) / (games + prior_games))
+
+
+def hero_log_odds(stats, prior_games=PRIOR_GAMES):
+    """Return the log-odds of each hero winning."""
+    return smoothed_log_odds(stats['wins'], stats['games'], 0.0, prior_games)
+
+
+def synergy(stats, prior_games=PRIOR_GAMES):
+    """Return the (H, H) log-odds of each pair of heroes winning together, beyond the sum of the heroes' log-odds."""
+    heroes = hero_log_odds(stats, prior_games)
+    expected = heroes[:, np.newaxis] + heroes[np.newaxis, :]
+    pairs = smoothed_log_odds(stats['pair_wins'], stats['pair_games'], expected, prior_games) - expected
+    np.fill_diagonal(pairs, 0.0)
+    return pairs
+
+
+def counters(stats, prior_games=PRIOR_GAMES):
+    """Return the (H, H) log-odds of each row hero beating the column hero, beyond the difference of their log-odds.
+
+    Positive values mean the row hero counters the column hero.
+    """
+    heroes = hero_log_odds(stats, prior_games)
+    expected = heroes[:, np.newaxis] - heroes[np.newaxis, :]
+    matchups = smoothed_log_odds(stats['matchup_wins'], stats['matchup_games'], expected, prior_games) - expected
+    np.fill_diagonal(matchups, 0.0)
+    return matchups
+
+
+def baseline_predict(stats, prior_games=PRIOR_GAMES):
+    """Return a function giving the radiant win probabilities of a batch of picks vectors from the statistics.
+
+    The log-odds of the draft are the sum of the radiant advantage, the heroes' log-odds, the synergies of each team
+    and the counters between the teams. The function can be used in place of a model's in draft.recommend.
+    """
+    radiant_advantage = log_odds((stats['radiant_wins'] + 0.5 * prior_games) / (stats['count'] + prior_games))
+    heroes = hero_log_odds(stats, prior_games)
+    pairs = synergy(stats, prior_games) / 2  # Each pair is counted twice in the sum over a team.
+    matchups = counters(stats, prior_games)
+
+    def predict(batch):
+        batch = np.asarray(batch)
+        radiant = (batch > 0).astype(np.float64)
+        dire = (batch < 0).astype(np.float64)
+        x = (radiant_advantage + (radiant - dire) @ heroes + ((radiant @ pairs) * radiant).sum(axis=1) -
+             ((dire @ pairs) * dire).sum(axis=1) + ((radiant @ matchups) * dire).sum(axis=1))
+        return sigmoid(x)
+    return predict
+
+
+def top_pairs(values, names, k=10):
+    """Return the k largest values of an (H, H) array as (row name, column name, value) triples."""
+    rows, columns = np.unravel_index(np.argsort(-values, axis=None)[:k], values.shape)
+    return [(names[r], names[c], float(values[r, c])) for r, c in zip(rows, columns)]
+
+
+if __name__ == '__main__':
+    hero_stats = update_stats(config.TRAINING_DATA_FILE, config.HERO_STATS_FILE)
+    if hero_stats is not None and hero_stats['count']:
+        names_by_id = {h['id']: h['localized_name'] for h in load_hero_index().heroes}
+        hero_names = [names_by_id.get(h, str(h)) for h in hero_stats['hero_ids'].tolist()]
+        win_rates = sigmoid(hero_log_odds(hero_stats))
+        print('Highest win rates:')
+        for h in np.argsort(-win_rates)[:10]:
+            print('{:20} {:.3f} ({} games)'.format(hero_names[h], win_rates[h], hero_stats['games'][h]))
+        print('Strongest synergies:')
+        synergies = synergy(hero_stats)
+        upper = np.triu(np.ones(synergies.shape, dtype=bool), 1)  # Each pair once.
+        for first, second, value in top_pairs(np.where(upper, synergies, -np.inf), hero_names):
+            print('{:20} {:20} {:+.3f}'.format(first, second, value))
+        print('Strongest counters:')
+        for first, second, value in top_pairs(counters(hero_stats), hero_names):
+            print('{:20} counters {:20} {:+.3f}'.format(first, second, value))
@@ -0,0 +1,118 @@
+"""Local stub server replaying recorded Steam Web API and OpenDota API responses.
+
+Responses are recorded by installing a RecordingSession with `sessions.set_session` before making requests. Serving
+the recordings and pointing the API URLs in config.py at the server allows fetching to be run and benchmarked
+offline, e.g. with `python stub_server.py recordings`.
+"""
+import argparse
+from contextlib import contextmanager
+import gzip
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import threading
+from urllib.parse import parse_qsl, urlsplit
+
+import config
+import sessions
+
+# Query parameters which do not affect the response.
+IGNORED_PARAMETERS = {'key'}
+
+
+def recording_filename(directory, api, path, params):
+    params = sorted((k, str(v)) for k, v in params if k not in IGNORED_PARAMETERS)
+    key = hashlib.sha1(json.dumps([api, path, params]).encode()).hexdigest()
+    return os.path.join(directory, key + '.json')
+
+
+def split_api_url(url):
+    """Return the API name, path relative to the API's base URL and query parameters of a request URL."""
+    for api, base in (('steam', config.STEAM_API_URL), ('opendota', config.OPENDOTA_API_URL)):
+        if url.startswith(base + '/'):
+            parts = urlsplit(url[len(base):])
+            return api, parts.path, parse_qsl(parts.query)
+    return None
+
+
+class RecordingSession:
+    """Session which saves the responses to API requests in a directory as they are received."""
+
+    def __init__(self, directory, session=None):
+        self.directory = directory
+        self.session = sessions.create_session() if session is None else session
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, url, **kwargs):
+        response = self.session.get(url, **kwargs)
+        request = split_api_url(response.request.url)
+        if request is not None and response.status_code not in (429, 503):
+            api, path, params = request
+            record = {'api': api, 'path': path, 'params': params, 'status': response.status_code,
+                      'body': response.text}
+            with open(recording_filename(self.directory, api, path, params), 'w') as f:
+                json.dump(record, f)
+        return response
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Handler replying to requests for /<api>/<path> with the response recorded in `directory`."""
+    protocol_version = 'HTTP/1.1'  # Keep connections alive, like the real APIs.
+    directory = None
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        api, _, path = parts.path.lstrip('/').partition('/')
+        try:
+            with open(recording_filename(self.directory, api, '/' + path, parse_qsl(parts.query))) as f:
+                record = json.load(f)
+            status = record['status']
+            body = record['body'].encode()
+        except FileNotFoundError:
+            status = 404
+            body = b'{"error": "No recorded response."}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_server(directory, port=0):
+    handler = type('StubHandler', (StubHandler,), {'directory': directory})
+    return ThreadingHTTPServer(('127.0.0.1', port), handler)
+
+
+@contextmanager
+def stub_apis(directory):
+    """Serve recorded responses from a directory while API requests are directed to the stub server."""
+    server = create_server(directory)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    steam_api_url, opendota_api_url = config.STEAM_API_URL, config.OPENDOTA_API_URL
+    config.STEAM_API_URL, config.OPENDOTA_API_URL = base + '/steam', base + '/opendota'
+    try:
+        yield base
+    finally:
+        config.STEAM_API_URL, config.OPENDOTA_API_URL = steam_api_url, opendota_api_url
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory', help='directory of recorded responses')
+    parser.add_argument('--port', type=int, default=8570)
+    arguments = parser.parse_args()
+    stub_server = create_server(arguments.directory, arguments.port)
+    print(f"Set STEAM_API_URL = 'http://127.0.0.1:{arguments.port}/steam' and "
+          f"OPENDOTA_API_URL = 'http://127.0.0.1:{arguments.port}/opendota' in config.py to use the stub server.")
+    stub_server.serve_forever()
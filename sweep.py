@@ -0,0 +1,159 @@
+"""Hyperparameter sweep with k-fold cross-validation, training many models at once.
+
+Every combination of the hyperparameters in config.sweep_grid is trained on each fold of the training part of the
+training data (the first 90% of matches, as in train.py) in a pool of processes. Each process streams batches from the
+memory-mapped training data, so all processes share one copy of it in memory, and its threads are limited and pinned
+to its own cores, so the processes do not compete for them. The combination with the best mean validation accuracy is
+then trained on the whole training part, evaluated on the test part and saved like a model trained by train.py.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import config
+from inference import export_weights
+from process import read_training_meta
+from models import MODELS, training_dataset
+from train import hero_count
+
+# Hyperparameters of the model trained by train.py, used for those not in the sweep grid.
+DEFAULTS = {'input_mode': config.input_mode, 'units': (128, 64), 'dropout': 0.2, 'learning_rate': 0.01,
+            'batch_size': 65536, 'epochs': 12}
+
+
+def grid_parameters(grid):
+    """Return the hyperparameters of every combination of the values in a grid, completed with DEFAULTS."""
+    names = list(grid)
+    return [dict(DEFAULTS, **dict(zip(names, values))) for values in product(*(grid[n] for n in names))]
+
+
+def fold_ranges(num_matches, folds):
+    """Return (training ranges, validation ranges) for each of k folds of matches 0 to num_matches."""
+    bounds = np.linspace(0, num_matches, folds + 1).round().astype(int).tolist()
+    return [([(0, start), (stop, num_matches)], [(start, stop)]) for start, stop in zip(bounds, bounds[1:])]
+
+
+def available_cores():
+    """Return the cores this process may run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def init_worker(threads, cores):
+    """Limit the threads used by a worker process and pin it to the next set of cores from a queue."""
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores.get())
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def train_job(directory, num_heroes, parameters, training_ranges, evaluation_ranges, seed=0, model_file=None,
+              weights_file=None):
+    """Train a model on ranges of the training data and return its hyperparameters and evaluation.
+
+    If file names are given, the model is saved and its weights are exported to them.
+    """
+    start_time = time.perf_counter()
+    tf.random.set_seed(seed)
+    model = MODELS[parameters['input_mode']](num_heroes, units=parameters['units'], dropout=parameters['dropout'],
+                                             learning_rate=parameters['learning_rate'])
+    model.fit(training_dataset(directory, num_heroes, training_ranges, batch_size=parameters['batch_size'], seed=seed,
+                               input_mode=parameters['input_mode']),
+              epochs=parameters['epochs'], verbose=0)
+    loss, accuracy = model.evaluate(training_dataset(directory, num_heroes, evaluation_ranges,
+                                                     batch_size=parameters['batch_size'],
+                                                     input_mode=parameters['input_mode']), verbose=0)
+    if model_file is not None:
+        model.save(model_file)
+    if weights_file is not None:
+        export_weights(model, weights_file)
+    return {'parameters': parameters, 'loss': loss, 'accuracy': accuracy, 'seconds': time.perf_counter() - start_time}
+
+
+def create_pool(workers, threads):
+    """Return a pool of worker processes, each using `threads` threads pinned to cores of its own where possible."""
+    context = multiprocessing.get_context('spawn')  # TensorFlow is not safe to fork.
+    cores = context.Queue()
+    available = available_cores()
+    for worker in range(workers):
+        worker_cores = available[worker * threads:(worker + 1) * threads]
+        # Workers share all cores if there are not enough for each to have its own.
+        cores.put(set(worker_cores) if len(worker_cores) == threads else set(available))
+    os.environ['OMP_NUM_THREADS'] = str(threads)  # Inherited by the workers.
+    return ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker, initargs=(threads, cores))
+
+
+def summarize(results, grid):
+    """Return the mean and standard deviation of the validation loss and accuracy of each combination, best first."""
+    combinations = {}
+    for result in results:
+        key = json.dumps({n: result['parameters'][n] for n in grid})
+        combinations.setdefault(key, []).append(result)
+    summary = []
+    for key, fold_results in combinations.items():
+        accuracies = np.array([r['accuracy'] for r in fold_results])
+        losses = np.array([r['loss'] for r in fold_results])
+        summary.append({'parameters': fold_results[0]['parameters'], 'grid': json.loads(key),
+                        'folds': len(fold_results), 'accuracy': accuracies.mean(), 'accuracy_std': accuracies.std(),
+                        'loss': losses.mean(), 'seconds': sum(r['seconds'] for r in fold_results)})
+    return sorted(summary, key=lambda s: (-s['accuracy'], s['loss']))
+
+
+def print_summary(summary):
+    print('{:>4}  {:60} {:>17} {:>8} {:>8}'.format('rank', 'hyperparameters', 'accuracy', 'loss', 'time'))
+    for rank, s in enumerate(summary, 1):
+        hyperparameters = ', '.join(f'{k}={v}' for k, v in s['grid'].items())
+        print('{:>4}  {:60} {:>8.4f} ± {:.4f} {:>8.4f} {:>7.0f}s'.format(rank, hyperparameters, s['accuracy'],
+                                                                         s['accuracy_std'], s['loss'], s['seconds']))
+
+
+def sweep(directory, grid, folds, workers, threads=None, results_file=None):
+    """Cross-validate every combination of hyperparameters in a grid, then train and save the best combination.
+
+    Return the summary of the combinations, best first, and the test result of the best combination.
+    """
+    meta = read_training_meta(directory)
+    if meta is None:
+        print('{} not found.'.format(directory))
+        return None
+    num_heroes = hero_count()
+    test_start = round(0.9 * meta['count'])
+    if threads is None:
+        threads = max(1, len(available_cores()) // workers)
+    jobs = [(parameters, training, validation)
+            for parameters in grid_parameters(grid) for training, validation in fold_ranges(test_start, folds)]
+    print(f'Training {len(jobs)} models ({len(jobs) // folds} combinations, {folds} folds) in {workers} processes '
+          f'of {threads} threads.')
+    results = []
+    with create_pool(workers, threads) as executor:
+        futures = [executor.submit(train_job, directory, num_heroes, *job) for job in jobs]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            print(f'{len(results)}/{len(jobs)}: accuracy {result["accuracy"]:.4f}, {result["parameters"]}')
+            if results_file is not None:
+                with open(results_file, 'a') as f:
+                    f.write(json.dumps(result) + '\n')
+        summary = summarize(results, grid)
+        print_summary(summary)
+
+        best = summary[0]['parameters']
+        print(f'Training the best hyperparameters on all training matches: {best}')
+        test_result = executor.submit(train_job, directory, num_heroes, best, [(0, test_start)],
+                                      [(test_start, meta['count'])], 0, config.MODEL_FILE,
+                                      config.WEIGHTS_FILE).result()
+    print(f'Test accuracy {test_result["accuracy"]:.4f}, loss {test_result["loss"]:.4f}. Model saved to '
+          f'{config.MODEL_FILE} and {config.WEIGHTS_FILE}.')
+    return summary, test_result
+
+
+if __name__ == '__main__':
+    sweep(config.TRAINING_DATA_FILE, config.sweep_grid, config.sweep_folds, config.sweep_workers,
+          config.sweep_threads, config.SWEEP_RESULTS_FILE)
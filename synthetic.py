@@ -0,0 +1,145 @@
+"""Deterministic synthetic match data, for measuring the pipeline without a Steam Web API key.
+
+Heroes are taken from the hero data file. Some heroes are picked much more often than others, and each has a hidden
+strength which affects the results of its matches, so a model can learn from the data. Raw API pages also contain
+matches of other game modes and lobby types, matches with leavers and matches with bots, which the crawler rejects.
+The same arguments always give the same data.
+"""
+import argparse
+import json
+
+import numpy as np
+
+import config
+from database import append_matches
+from hero_index import load_hero_index
+from process import CHUNK_SIZE, TEAM_SIZE
+
+GAME_MODE = 22  # All pick.
+LOBBY_TYPE = 7  # Ranked.
+OTHER_GAME_MODE_RATE = 0.2  # Fraction of raw matches of another game mode, e.g. turbo.
+OTHER_LOBBY_TYPE_RATE = 0.1  # Fraction of raw matches of another lobby type, e.g. unranked.
+LEAVER_RATE = 0.05  # Fraction of raw matches with a player who abandoned the match.
+BOT_RATE = 0.01  # Fraction of raw matches with bots.
+POPULARITY_EXPONENT = 0.8  # The nth most popular hero is picked in proportion to 1 / n ** POPULARITY_EXPONENT.
+STRENGTH_SCALE = 0.15  # Standard deviation of heroes' strengths, in log-odds of winning.
+RADIANT_ADVANTAGE = 0.1  # Log-odds of radiant winning a match of equally strong teams.
+FIRST_MATCH_ID = 5000000000
+FIRST_SEQ_NUM = 4200000000
+
+
+def hero_model(seed=0):
+    """Return the hero IDs, pick probabilities and strengths of the heroes in the hero data file."""
+    rng = np.random.default_rng(seed)
+    hero_ids = load_hero_index().ids
+    popularity = 1 / (1 + rng.permutation(hero_ids.size)) ** POPULARITY_EXPONENT
+    strengths = rng.normal(0.0, STRENGTH_SCALE, hero_ids.size)
+    return hero_ids, popularity / popularity.sum(), strengths
+
+
+def sample_drafts(rng, num_matches, probabilities):
+    """Return the indices of the ten distinct heroes of each match, picked with the given probabilities."""
+    # The heroes with the largest log-probabilities plus Gumbel noise are a sample without replacement.
+    keys = np.log(probabilities) + rng.gumbel(size=(num_matches, probabilities.size))
+    picks = np.argpartition(-keys, 2 * TEAM_SIZE - 1, axis=1)[:, :2 * TEAM_SIZE]
+    return rng.permuted(picks, axis=1)  # Split the heroes between the teams at random.
+
+
+def random_drafts(num_matches, seed=0):
+    """Return radiant and dire picks of random drafts of distinct heroes, as (num_matches, 5) arrays of hero IDs."""
+    hero_ids, probabilities, _ = hero_model(seed)
+    drafts = hero_ids[sample_drafts(np.random.default_rng(seed), num_matches, probabilities)]
+    return drafts[:, :TEAM_SIZE], drafts[:, TEAM_SIZE:]
+
+
+def synthetic_chunks(num_matches, seed=0, raw=False, chunk_size=CHUNK_SIZE):
+    """Yield the matches with sequence numbers from FIRST_SEQ_NUM in chunks of arrays.
+
+    Each chunk is a dict of match_id, match_seq_num, radiant_win, game_mode, lobby_type, human_players, leaver (the
+    slot of a player who abandoned the match, or -1) and picks_radiant and picks_dire (hero IDs, shape (n, 5)). Unless
+    raw, every match is one the crawler keeps.
+    """
+    hero_ids, probabilities, strengths = hero_model(seed)
+    for chunk_index, start in enumerate(range(0, num_matches, chunk_size)):
+        rng = np.random.default_rng([seed, chunk_index])
+        n = min(chunk_size, num_matches - start)
+        picks = sample_drafts(rng, n, probabilities)
+        picked_strengths = strengths[picks]
+        radiant_log_odds = (RADIANT_ADVANTAGE + picked_strengths[:, :TEAM_SIZE].sum(axis=1) -
+                            picked_strengths[:, TEAM_SIZE:].sum(axis=1))
+        chunk = {'match_id': FIRST_MATCH_ID + start + np.arange(n),
+                 'match_seq_num': FIRST_SEQ_NUM + start + np.arange(n),
+                 'radiant_win': rng.random(n) < 1 / (1 + np.exp(-radiant_log_odds)),
+                 'game_mode': np.full(n, GAME_MODE), 'lobby_type': np.full(n, LOBBY_TYPE),
+                 'human_players': np.full(n, 2 * TEAM_SIZE), 'leaver': np.full(n, -1),
+                 'picks_radiant': hero_ids[picks[:, :TEAM_SIZE]], 'picks_dire': hero_ids[picks[:, TEAM_SIZE:]]}
+        if raw:
+            chunk['game_mode'][rng.random(n) < OTHER_GAME_MODE_RATE] = 23  # Turbo.
+            chunk['lobby_type'][rng.random(n) < OTHER_LOBBY_TYPE_RATE] = 0  # Unranked.
+            leavers = rng.random(n) < LEAVER_RATE
+            chunk['leaver'][leavers] = rng.integers(2 * TEAM_SIZE, size=leavers.sum())
+            bots = rng.random(n) < BOT_RATE
+            chunk['human_players'][bots] = rng.integers(1, 2 * TEAM_SIZE, size=bots.sum())
+        yield chunk
+
+
+def database_matches(chunk):
+    """Return the database entries of the matches of a chunk which the crawler keeps."""
+    kept = ((chunk['game_mode'] == GAME_MODE) & (chunk['lobby_type'] == LOBBY_TYPE) &
+            (chunk['human_players'] == 2 * TEAM_SIZE) & (chunk['leaver'] == -1))
+    return [{'match_id': match_id, 'match_seq_num': seq_num, 'radiant_win': radiant_win, 'game_mode': GAME_MODE,
+             'lobby_type': LOBBY_TYPE, 'picks_radiant': sorted(radiant), 'picks_dire': sorted(dire)}
+            for match_id, seq_num, radiant_win, radiant, dire in zip(
+                chunk['match_id'][kept].tolist(), chunk['match_seq_num'][kept].tolist(),
+                chunk['radiant_win'][kept].tolist(), chunk['picks_radiant'][kept].tolist(),
+                chunk['picks_dire'][kept].tolist())]
+
+
+def write_database(filename, num_matches, seed=0):
+    """Append num_matches synthetic matches to a match database."""
+    for chunk in synthetic_chunks(num_matches, seed):
+        append_matches(filename, database_matches(chunk))
+
+
+def api_players(picks_radiant, picks_dire, leaver, human_players):
+    """Return the players of a match as given by the API, bots being the last players and lacking a leaver status."""
+    players = []
+    for slot, hero_id in enumerate(picks_radiant + picks_dire):
+        player = {'account_id': 4294967295, 'player_slot': (slot // TEAM_SIZE) << 7 | slot % TEAM_SIZE,
+                  'hero_id': hero_id, 'item_0': 1, 'item_1': 2, 'item_2': 3, 'item_3': 4, 'item_4': 5, 'item_5': 6,
+                  'kills': 5, 'deaths': 5, 'assists': 5, 'leaver_status': 2 if slot == leaver else 0,
+                  'last_hits': 100, 'denies': 10, 'gold_per_min': 400, 'xp_per_min': 500, 'level': 20}
+        if slot >= human_players:
+            del player['leaver_status']
+        players.append(player)
+    return players
+
+
+def history_pages(num_matches, seed=0, matches_per_page=100):
+    """Yield raw GetMatchHistoryBySequenceNum response bodies of num_matches synthetic matches."""
+    page = []
+    # Smaller chunks than the default, since the matches of a chunk are all converted to dicts at once.
+    for chunk in synthetic_chunks(num_matches, seed, raw=True, chunk_size=100 * matches_per_page):
+        columns = {k: v.tolist() for k, v in chunk.items()}
+        for i in range(len(columns['match_id'])):
+            page.append({'match_id': columns['match_id'][i], 'match_seq_num': columns['match_seq_num'][i],
+                         'radiant_win': columns['radiant_win'][i], 'duration': 2400, 'start_time': 1600000000,
+                         'game_mode': columns['game_mode'][i], 'lobby_type': columns['lobby_type'][i],
+                         'human_players': columns['human_players'][i],
+                         'players': api_players(columns['picks_radiant'][i], columns['picks_dire'][i],
+                                                columns['leaver'][i], columns['human_players'][i])})
+            if len(page) == matches_per_page:
+                yield json.dumps({'result': {'status': 1, 'num_results': len(page), 'matches': page}})
+                page = []
+    if page:
+        yield json.dumps({'result': {'status': 1, 'num_results': len(page), 'matches': page}})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a database of synthetic matches.')
+    parser.add_argument('matches', type=int, help='number of matches')
+    parser.add_argument('--output', default=config.MATCH_DATA_FILE, help='match database to append to')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write_database(args.output, args.matches, args.seed)
+    print(f'Wrote {args.matches} synthetic matches to {args.output}.')
@@ -1,39 +1,29 @@
-import json
-from operator import itemgetter
+"""Encoding of drafts as model input, and training of the model.
+
+TensorFlow and matplotlib are only imported when a model is trained or its history plotted, so the encoding functions
+can be used, e.g. by the command line interface in cli.py, without the seconds it takes to import them.
+"""
+import os
 
-import matplotlib.pyplot as plt
 import numpy as np
-from tensorflow.keras.constraints import max_norm
-from tensorflow.keras.layers import Dense, Dropout
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.optimizers import Adam
 
 import config
+from draft import recommend
+from hero_index import load_hero_index
+from inference import export_weights, numpy_predict
+from process import pick_dtype, read_results, read_training_data, read_training_meta
 
 
 def hero_count():
-    with open(config.HERO_DATA_FILE) as hero_file:
-        count = json.load(hero_file)['count']
-    return count
+    return len(load_hero_index().ids)
 
 
 def hero_dicts():
-    with open(config.HERO_DATA_FILE) as hero_file:
-        heroes = json.load(hero_file)['heroes']
-    return heroes
+    return [dict(h) for h in load_hero_index().heroes]
 
 
 def one_hot_matrix(num_heroes):
-    with open(config.HERO_DATA_FILE) as hero_file:
-        hero_list = [h['id'] for h in json.load(hero_file)['heroes']]
-    max_id = max(hero_list)
-    hero_matrix = np.zeros((max_id + 1, num_heroes), dtype=int)
-    hot_index = 0
-    for h in range(max_id + 1):
-        if h in hero_list:
-            hero_matrix[h, hot_index] = 1
-            hot_index += 1
-    return hero_matrix
+    return load_hero_index().one_hot[:, :num_heroes]
 
 
 def picks_vector(radiant, dire, num_heroes, hero_matrix=None):
@@ -47,22 +37,67 @@ def picks_vector(radiant, dire, num_heroes, hero_matrix=None):
     return vector
 
 
-def load_data(filename, num_heroes):
-    with open(filename) as data_file:
-        database = json.load(data_file)
-    picks_radiant = database['picks_radiant']
-    picks_dire = database['picks_dire']
-    labels = np.array(database['radiant_win']).astype(int)
-    num_matches = len(labels)
-    data = np.empty((num_matches, num_heroes), dtype=int)
-    hero_matrix = one_hot_matrix(num_heroes)
-    for m in range(num_matches):
-        radiant = picks_radiant[m]
-        dire = picks_dire[m]
-        data[m] = picks_vector(radiant, dire, num_heroes, hero_matrix=hero_matrix)
+def hero_columns(num_heroes, hero_matrix=None):
+    """Return the column of each hero ID in picks vectors, with IDs not belonging to a hero mapped to num_heroes."""
+    if hero_matrix is None:
+        return load_hero_index().columns
+    return np.where(hero_matrix.any(axis=1), hero_matrix.argmax(axis=1), num_heroes)
+
+
+def encode_columns(radiant_columns, dire_columns, num_heroes, input_mode='dense'):
+    """Return the model input for many matches from the picks vector columns of each team's heroes.
+
+    For the dense input mode, this is the matches' picks vectors as the rows of an int8 array. For the indices input
+    mode, of models built by build_embedding_model, it is the radiant columns followed by the dire columns as the rows
+    of an array of the training data's pick dtype, so 10 bytes per match instead of a byte per hero. Columns of
+    num_heroes or more do not belong to a hero and are ignored.
+    """
+    radiant_columns = np.asarray(radiant_columns)
+    dire_columns = np.asarray(dire_columns)
+    if input_mode == 'indices':
+        return np.concatenate((radiant_columns, dire_columns), axis=1).astype(pick_dtype(num_heroes + 1))
+    data = np.zeros((radiant_columns.shape[0], num_heroes + 1), dtype=np.int8)
+    rows = np.arange(data.shape[0])[:, np.newaxis]
+    data[rows, np.minimum(radiant_columns, num_heroes)] += 1
+    data[rows, np.minimum(dire_columns, num_heroes)] -= 1
+    return data[:, :num_heroes]
+
+
+def picks_matrix(picks_radiant, picks_dire, num_heroes, hero_matrix=None):
+    """Return the picks vectors of many matches as the rows of an int8 array.
+
+    Equivalent to calling picks_vector for each match, for teams of distinct heroes.
+    """
+    columns = hero_columns(num_heroes, hero_matrix)
+    return encode_columns(columns[np.asarray(picks_radiant)], columns[np.asarray(picks_dire)], num_heroes)
+
+
+def load_data(directory, num_heroes, input_mode='dense'):
+    database = read_training_data(directory)
+    labels = database['radiant_win'].astype(int)
+    data = encode_columns(database['picks_radiant'], database['picks_dire'], num_heroes, input_mode)
     return data, labels
 
 
+def draft_batches(database, ranges, num_heroes, batch_size, shuffle_buffer, rng, input_mode='dense'):
+    """Yield batches of encoded picks and labels for the matches in (start, stop) ranges of memory-mapped training data.
+
+    Blocks of shuffle_buffer matches are read in a random order, and the matches of each block are shuffled and
+    encoded a batch at a time, so memory use does not depend on the number of matches.
+    """
+    blocks = [(block_start, min(block_start + shuffle_buffer, stop))
+              for start, stop in ranges for block_start in range(start, stop, shuffle_buffer)]
+    for block in rng.permutation(len(blocks)):
+        block_start, block_stop = blocks[block]
+        picks_radiant = np.asarray(database['picks_radiant'][block_start:block_stop])
+        picks_dire = np.asarray(database['picks_dire'][block_start:block_stop])
+        labels = read_results(database['radiant_win'], block_start, block_stop).astype(np.int8)
+        order = rng.permutation(block_stop - block_start)
+        for batch_start in range(0, order.size, batch_size):
+            rows = order[batch_start:batch_start + batch_size]
+            yield encode_columns(picks_radiant[rows], picks_dire[rows], num_heroes, input_mode), labels[rows]
+
+
 def split_data(data, labels, training_fraction=0.9):
     """Split data into training and testing parts."""
     training_index = round(training_fraction * (labels.shape[0]))
@@ -73,71 +108,84 @@ def split_data(data, labels, training_fraction=0.9):
     return train_data, train_labels, test_data, test_labels
 
 
-def build_model(num_heroes):
-    model = Sequential()
-    model.add(Dropout(0.2, input_shape=(num_heroes,)))
-    # model.add(Dense(128, activation='relu', input_dim=num_heroes))
-    model.add(Dense(128, activation='relu', kernel_constraint=max_norm(3)))
-    model.add(Dropout(0.2))
-    model.add(Dense(64, activation='relu', kernel_constraint=max_norm(3)))
-    model.add(Dropout(0.2))
-    model.add(Dense(1, activation='sigmoid'))
-
-    adam = Adam(lr=0.01)
-    model.compile(optimizer=adam, loss='binary_crossentropy', metrics=['accuracy'])
-    return model
+def train(directory, model_file, weights_file, input_mode='dense', stream=False, epochs=12):
+    """Train a model on the first 90% of the training data and save it and its weights.
 
+    Return the model, its training history and its loss and accuracy on the remaining 10% of the training data.
+    TensorFlow is only imported when this is called.
+    """
+    from models import MODELS, training_dataset
 
-if __name__ == '__main__':
-    heroes_count = hero_count()
-    drafts, radiant_win = load_data(config.TRAINING_DATA_FILE, heroes_count)
-    train_drafts, train_radiant_win, test_drafts, test_radiant_win = split_data(drafts, radiant_win)
-
-    model = build_model(heroes_count)
+    num_heroes = hero_count()
+    model = MODELS[input_mode](num_heroes)
     model.summary()
-    history = model.fit(train_drafts, train_radiant_win, batch_size=65536, epochs=12, validation_split=0.1)
+    if stream:
+        num_matches = read_training_meta(directory)['count']
+        test_start = round(0.9 * num_matches)
+        validation_start = round(0.9 * test_start)
+        train_dataset, validation_dataset, test_dataset = (
+            training_dataset(directory, num_heroes, [(start, stop)], input_mode=input_mode)
+            for start, stop in ((0, validation_start), (validation_start, test_start), (test_start, num_matches)))
+        history = model.fit(train_dataset, epochs=epochs, validation_data=validation_dataset)
+        test_data = (test_dataset,)
+    else:
+        drafts, radiant_win = load_data(directory, num_heroes, input_mode)
+        train_drafts, train_radiant_win, test_drafts, test_radiant_win = split_data(drafts, radiant_win)
+        history = model.fit(train_drafts, train_radiant_win, batch_size=65536, epochs=epochs, validation_split=0.1)
+        test_data = (test_drafts, test_radiant_win)
+    model.save(model_file)
+    export_weights(model, weights_file)
+    return model, history, model.evaluate(*test_data)
+
+
+def plot_history(history, directory=None):
+    """Graph training and validation loss and accuracy by epoch.
+
+    The graphs are saved to loss.png and accuracy.png in directory, without needing a display, or shown in windows if
+    directory is None. Matplotlib is only imported when this is called.
+    """
+    import matplotlib
+    if directory is not None:
+        matplotlib.use('Agg')
+        os.makedirs(directory, exist_ok=True)
+    import matplotlib.pyplot as plt
 
-    # Graph training and validation loss and accuracy.
     acc = history.history['acc']
     val_acc = history.history['val_acc']
     loss = history.history['loss']
     val_loss = history.history['val_loss']
     epochs = range(1, len(acc) + 1)
-    # "bo" is for "blue dot"
-    plt.plot(epochs, loss, 'rx', markersize=4, label='Training loss')
-    # b is for "solid blue line"
-    plt.plot(epochs, val_loss, 'b', label='Validation loss')
-    plt.title('Training and validation loss')
-    plt.xlabel('Epochs')
-    plt.ylabel('Loss')
-    plt.legend()
-    plt.show()
-    plt.clf()  # clear figure
-    plt.plot(epochs, acc, 'rx', markersize=4, label='Training acc')
-    plt.plot(epochs, val_acc, 'b', label='Validation acc')
-    plt.title('Training and validation accuracy')
-    plt.xlabel('Epochs')
-    plt.ylabel('Accuracy')
-    plt.legend()
-    plt.show()
-
-    # Evaluate model on test data.
-    results = model.evaluate(test_drafts, test_radiant_win)
+    for name, title, training, validation in (('loss', 'Loss', loss, val_loss), ('accuracy', 'Accuracy', acc, val_acc)):
+        plt.clf()  # clear figure
+        plt.plot(epochs, training, 'rx', markersize=4, label=f'Training {name}')
+        plt.plot(epochs, validation, 'b', label=f'Validation {name}')
+        plt.title(f'Training and validation {name}')
+        plt.xlabel('Epochs')
+        plt.ylabel(title)
+        plt.legend()
+        if directory is None:
+            plt.show()
+        else:
+            filename = os.path.join(directory, f'{name}.png')
+            plt.savefig(filename)
+            print(f'Saved {filename}')
+
+
+def print_recommendations(picks):
+    """Print (hero ID, win probability) pairs with the heroes' names."""
+    heroes = {h['id']: h for h in hero_dicts()}
+    for hero_id, win_probability in picks:
+        print('{:3} {:20} {:6.6}'.format(hero_id, heroes[hero_id]['localized_name'], str(win_probability)))
+
+
+if __name__ == '__main__':
+    model, history, results = train(config.TRAINING_DATA_FILE, config.MODEL_FILE, config.WEIGHTS_FILE,
+                                    config.input_mode, config.stream_training_data)
+    plot_history(history, None if config.show_plots else config.PLOT_DIRECTORY)
     print(results)
 
-    heroes = hero_dicts()
-    hero_map = one_hot_matrix(heroes_count)
+    hero_map = one_hot_matrix(hero_count())
     radiant = [22, 71, 42, 70]
     dire = [37, 5, 99, 67, 82]
-    for h in heroes:
-        test_input = np.array([picks_vector(radiant + [h['id']], dire, heroes_count, hero_map)])
-        h['radiant_win'] = model.predict(test_input)[0, 0]
-    sorted_heroes = sorted(heroes, key=itemgetter('radiant_win'), reverse=True)
-    current_picks = set(radiant + dire)
-    counter = 0
-    for h in sorted_heroes:
-        if h['id'] not in current_picks:
-            print('{:3} {:20} {:6.6}'.format(h['id'], h['localized_name'], str(h['radiant_win'])))
-            counter += 1
-            if counter > 40:
-                break
+    print_recommendations(recommend(radiant, dire, 'radiant', numpy_predict(config.WEIGHTS_FILE),
+                                    load_hero_index().ids.tolist(), hero_map, k=41))